@@ -1,12 +1,15 @@
 import asyncio
-from datetime import datetime
+import hashlib
+import heapq
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import os
 import logging
-import json
+import orjson
 
 from app.whatsapp import send_message
 from shared import db
-from shared.models import Patient
+from shared.models import Patient, Conversation
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.prebuilt import ToolNode, tools_condition
@@ -19,6 +22,7 @@ from langchain_mcp_adapters.prompts import load_mcp_prompt
 
 from langgraph.graph import MessagesState
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.memory import InMemorySaver
 
 from langchain_openai import ChatOpenAI
@@ -43,21 +47,89 @@ class State(MessagesState):
 # Global async queue
 message_queue: asyncio.Queue = asyncio.Queue()
 
+# Per-patient inboxes (keyed by phone number), each drained by a single worker while it exists
+_inboxes: dict[str, asyncio.Queue] = {}
+# Strong references to running workers; the event loop only keeps weak ones
+_workers: set[asyncio.Task] = set()
 
-async def create_graph(session):
+# Conversation timeout index: a min-heap of (last_interaction_time, thread_id) plus the latest
+# interaction per thread. Heap entries superseded by a newer interaction are skipped lazily.
+_timeout_index: list[tuple[datetime, str]] = []
+_last_interaction: dict[str, datetime] = {}
+
+
+# Maximum number of persisted messages replayed into a conversation whose agent state was lost
+_HISTORY_LIMIT = 20
+
+# Replies to formulaic opening messages ("hi", "hello"), keyed by _turn_cache_key.
+# Entries are (reply, expires_at); only turns answered without any tool call are stored.
+_turn_cache: dict[str, tuple[str, datetime]] = {}
+_TURN_CACHE_TTL = timedelta(minutes=10)
+_TURN_CACHE_MAX_ENTRIES = 1024
+
+# Rendered per-patient system prompts kept by a graph, least recently used evicted first
+_SYS_MSG_CACHE_MAX_ENTRIES = 256
+
+
+def _turn_cache_key(patient: Patient, message: str) -> str:
+    """
+    Hashes the inputs an opening reply can depend on: the patient details shown in the
+    system prompt (not the phone number) and the whitespace/case-normalized message.
+    """
+    normalized = " ".join(message.casefold().split())
+    raw = "\x1f".join((patient.name, str(patient.age), str(patient.gender), normalized))
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _get_cached_reply(key: str) -> str | None:
+    entry = _turn_cache.get(key)
+    if entry is None:
+        return None
+    reply, expires_at = entry
+    if expires_at < datetime.now():
+        del _turn_cache[key]
+        return None
+    return reply
+
+
+def _store_cached_reply(key: str, reply: str) -> None:
+    if len(_turn_cache) >= _TURN_CACHE_MAX_ENTRIES:
+        now = datetime.now()
+        for stale in [k for k, (_, expires_at) in _turn_cache.items() if expires_at < now]:
+            del _turn_cache[stale]
+        if len(_turn_cache) >= _TURN_CACHE_MAX_ENTRIES:
+            # Drop the oldest insertion
+            del _turn_cache[next(iter(_turn_cache))]
+    _turn_cache[key] = (reply, datetime.now() + _TURN_CACHE_TTL)
+
+
+async def _db(fn, *args, **kwargs):
+    """Runs a blocking shared.db call on a worker thread so the event loop stays responsive."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+def _touch_thread(thread_id: str, when: datetime) -> None:
+    """Records an interaction on a thread in the timeout index."""
+    _last_interaction[thread_id] = when
+    heapq.heappush(_timeout_index, (when, thread_id))
+
+
+async def create_graph(session, tools=None):
     """
     Creates and returns the agent graph.
     The graph consists of nodes for the assistant, tool calls, and state updates.
     The assistant node uses a ChatOpenAI model with access to the provided tools.
     Each conversation is tracked by a unique thread_id in the checkpointer.
     Args:
-        session: The MCP client session to load tools from.
+        session: The MCP client session to load tools and the system prompt from.
+        tools: Tools already loaded from the session; loaded here if not provided.
     Returns:
         The compiled StateGraph agent.
     """
     logger.info("Creating agent graph...")
 
-    tools = await load_mcp_tools(session)
+    if tools is None:
+        tools = await load_mcp_tools(session)
     systemPrompt = await load_mcp_prompt(
         session, 
         "system_prompt"
@@ -66,33 +138,51 @@ async def create_graph(session):
     llm = ChatOpenAI(model=os.getenv("OPENAI_MODEL_NAME", "gpt-4o"))
     llm_with_tools = llm.bind_tools(tools)
 
+    # The base prompt is constant for the lifetime of the graph; only the patient block varies.
+    system_header = systemPrompt[0].content
+    no_patient_sys_msg = SystemMessage(content=system_header)
+    # patient_id -> (fields the message was rendered from, SystemMessage)
+    patient_sys_msg_cache: OrderedDict[int, tuple[tuple, SystemMessage]] = OrderedDict()
+
+    def system_message_for(patient: Patient | None, conversation_id: int | None) -> SystemMessage:
+        if not patient:
+            return no_patient_sys_msg
+        key = (patient.name, patient.age, patient.gender, patient.phone_number, conversation_id)
+        # Popped and reinserted so the entry moves to the most recently used end
+        cached = patient_sys_msg_cache.pop(patient.id, None)
+        if cached and cached[0] == key:
+            patient_sys_msg_cache[patient.id] = cached
+            return cached[1]
+        patient_context = (f"\n\n--- Current Patient Information ---\n"
+                           f"Name: {patient.name}\n"
+                           f"Age: {patient.age or 'Not provided'}\n"
+                           f"Gender: {patient.gender or 'Not provided'}\n"
+                           f"Phone Number: {patient.phone_number}\n"
+                           f"Current Conversation ID: {conversation_id}\n"
+                           f"---------------------------------")
+        sys_msg = SystemMessage(content=system_header + patient_context)
+        if len(patient_sys_msg_cache) >= _SYS_MSG_CACHE_MAX_ENTRIES:
+            patient_sys_msg_cache.popitem(last=False)
+        patient_sys_msg_cache[patient.id] = (key, sys_msg)
+        return sys_msg
+
     # Graph
     builder = StateGraph(State)
 
     # Node: Assistant
     def assistant(state: State):
         """The main assistant node that generates responses using the LLM and tools."""
-        logger.debug(f"Assistant node invoked with state: {state}")
-        patient = state.get("patient")
-        patient_context = ""
-        if patient:
-            patient_context = (f"\n\n--- Current Patient Information ---\n"
-                             f"Name: {patient.name}\n"
-                             f"Age: {patient.age or 'Not provided'}\n"
-                             f"Gender: {patient.gender or 'Not provided'}\n"
-                             f"Phone Number: {patient.phone_number}\n"
-                             f"Current Conversation ID: {state.get('conversation_id')}\n"
-                             f"---------------------------------")
-        
-        final_system_prompt = systemPrompt[0].content + patient_context
-        sys_msg = SystemMessage(content=final_system_prompt)
+        logger.debug("Assistant node invoked with state: %s", state)
+        sys_msg = system_message_for(state.get("patient"), state.get("conversation_id"))
         response = llm_with_tools.invoke([sys_msg] + state["messages"])
         return {"messages": [response]}
 
     # Node: Update Timestamp
-    def update_timestamp_node(state: State) -> dict:
-        """Nodes that just updates the timestamp in the state."""
-        return {"last_interaction_time": datetime.now()}
+    async def update_timestamp_node(state: State, config: RunnableConfig) -> dict:
+        """Nodes that just updates the timestamp in the state and the timeout index."""
+        now = datetime.now()
+        _touch_thread(config["configurable"]["thread_id"], now)
+        return {"last_interaction_time": now}
     
     builder.add_node("assistant", assistant)
     builder.add_node("tools", ToolNode(tools))
@@ -119,148 +209,271 @@ async def create_graph(session):
 async def enqueue_message(patient_phone: str, message: str):
     """
     Async function to enqueue incoming messages for processing by the agent.
-    Finds or creates a patient and a conversation, then adds the message to the queue.
-    The patient is identified by their phone number.
+    Only the raw message is queued so the webhook can return immediately; the consumer
+    resolves the patient and conversation.
     Args:
         patient_phone: The phone number of the patient sending the message.
         message: The content of the message sent by the patient.
     returns: 
         None
     """
-    logger.debug(f"Enqueueing message from {patient_phone}")
+    logger.debug("Enqueueing message from %s", patient_phone)
 
+    await message_queue.put({
+        "phone": patient_phone,
+        "message": message,
+        "timestamp": datetime.now(),
+    })
+
+
+async def _resolve_conversation(patient_phone: str) -> tuple[Patient, Conversation]:
+    """
+    Finds or creates a patient and an open conversation for them.
+    The patient is identified by their phone number.
+    """
     # Find a patient record
-    patient = db.get_patient_by_phone(patient_phone)
+    patient = await _db(db.get_patient_by_phone, patient_phone)
     if not patient:
         # For a new patient, create a basic record. The agent can gather more details.
-        patient = db.create_patient(Patient(name="New Patient", phone_number=patient_phone))
+        patient = await _db(db.create_patient, Patient(name="New Patient", phone_number=patient_phone))
 
     # Find an open conversation for the patient or create a new one
-    conversation = db.get_open_conversation(patient.id)
+    conversation = await _db(db.get_open_conversation, patient.id)
     if not conversation:
-        conversation = db.create_conversation(patient.id)
-    
-    logger.info(f"Enqueuing message for patient {patient.id} in conversation {conversation.id}")
+        conversation = await _db(db.create_conversation, patient.id)
 
-    await message_queue.put({
-        "conversation_id": conversation.id,
-        "patient": patient,
-        "message": message,
-        "timestamp": datetime.now(),
-    })
+    return patient, conversation
 
 
-async def consume_messages(agent):
+async def _collect_burst(inbox: asyncio.Queue, first: dict, window_seconds: float) -> list[dict]:
     """
-    Continuously consumes messages from the queue and processes them with the agent.
+    Gathers a burst of messages a patient sent in quick succession.
+    After each message, waits up to window_seconds for another one on the patient's inbox.
     Args:
-        agent: The StateGraph agent to process messages.
+        inbox: The patient's inbox queue.
+        first: The queue item that opened the burst.
+        window_seconds: How long to wait after the latest message of the burst.
+    Returns:
+        The queue items of the burst, oldest first.
     """
-    logger.info("Starting message consumer...")
+    burst = [first]
+    while window_seconds > 0:
+        try:
+            burst.append(await asyncio.wait_for(inbox.get(), timeout=window_seconds))
+        except TimeoutError:
+            break
+    return burst
 
-    while True:
-        logger.debug("Waiting for new message in queue...")
-        task = await message_queue.get()
-        conversation_id = task.get("conversation_id")
+
+async def _process_turn(agent, patient_phone: str, message: str, received_at: datetime | None = None):
+    """
+    Runs one agent turn for a patient's message: resolves the conversation, restores the
+    agent state from the DB if needed, replies, and persists the turn.
+    Args:
+        agent: The StateGraph agent to process messages.
+        patient_phone: The phone number of the patient sending the message.
+        message: The (possibly coalesced) text of the patient's message.
+        received_at: When the (first) message arrived, stored as the user message's time.
+    """
+    conversation_id = None
+    try:
+        patient, conversation = await _resolve_conversation(patient_phone)
+        conversation_id = conversation.id
+        patient_phone_for_reply = patient.phone_number
+        logger.info("Processing message for patient %s in conversation %s", patient.id, conversation_id)
+
+        config = {"configurable": {"thread_id": str(conversation_id)}}
+
+        # If agent has no state for this conversation, load it from the database.
+        # This handles cases where the agent restarts and loses its in-memory state.
+        # current_state is of type StateSnapshot
+        current_state = await agent.aget_state(config)
+        logger.debug("Current state for conversation %s: %s", conversation_id, current_state)
+
+        if current_state and current_state.values.get("messages"):
+            pre_len = len(current_state.values["messages"])
+            is_opening_turn = False
+        else:
+            logger.info("No agent state found for conversation %s. Checking DB for history...", conversation_id)
+            page = await _db(db.get_messages_page, conversation_id, _HISTORY_LIMIT)
+            history = page.messages
+            is_opening_turn = not history
+            # The tail may start mid-exchange (e.g. with a tool result whose call was cut off),
+            # so replay from the first user message to keep the sequence valid for the LLM,
+            # paging further back when the tail holds none.
+            while page.has_more and not any(msg.sender == 'user' for msg in history):
+                page = await _db(db.get_messages_page, conversation_id, _HISTORY_LIMIT, history[0].id)
+                history = page.messages + history
+            first_user = next((i for i, msg in enumerate(history) if msg.sender == 'user'), len(history))
+            history = history[first_user:]
+            history_messages = []
+            if history:
+                for msg in history:
+                    # Convert DB messages to appropriate Message types
+                    if msg.sender == 'user':
+                        history_messages.append(HumanMessage(content=msg.message))
+                    elif msg.sender == 'agent':
+                        history_messages.append(AIMessage(content=msg.message))
+                    elif msg.sender == 'agent_tool_call':
+                        # Rebuild AIMessage with tool_calls from JSON
+                        tool_calls = orjson.loads(msg.message)
+                        history_messages.append(AIMessage(content="", tool_calls=tool_calls))
+                    elif msg.sender == 'tool':
+                        # Rebuild ToolMessage from JSON
+                        tool_data = orjson.loads(msg.message)
+                        history_messages.append(ToolMessage(content=tool_data['content'], tool_call_id=tool_data['tool_call_id']))
+
+            update_payload = {
+                "messages": history_messages,
+                "patient": patient,
+                "conversation_id": conversation_id,
+            }
+            logger.info("Updating state for conversation %s with %s messages and patient info.", conversation_id, len(history_messages))
+            await agent.aupdate_state(config, update_payload, START)
+            pre_len = len(history_messages)
+
+        # Messages of this turn are collected and persisted together in a single transaction;
+        # the user's message keeps its receive time, the replies are stamped when written
+        pending = [("user", message, received_at)]
+        # Only opening turns are cacheable: later replies depend on the conversation so far
+        cache_key = _turn_cache_key(patient, message) if is_opening_turn else None
+        cached_reply = _get_cached_reply(cache_key) if cache_key else None
         try:
-            patient = task["patient"]
-            message = task["message"]
-            patient_phone_for_reply = patient.phone_number
-
-            config = {"configurable": {"thread_id": str(conversation_id)}}
-
-            # If agent has no state for this conversation, load it from the database.
-            # This handles cases where the agent restarts and loses its in-memory state.
-            # current_state is of type StateSnapshot
-            current_state = await agent.aget_state(config)
-            logger.debug(f"Current state for conversation {conversation_id}: {current_state}")
-
-            if current_state is None or not current_state.values.get("messages"):
-                logger.info(f"No agent state found for conversation {conversation_id}. Checking DB for history...")
-                history = db.get_messages(conversation_id)
-                history_messages = []
-                if history:
-                    for msg in history:
-                        # Convert DB messages to appropriate Message types
-                        if msg.sender == 'user':
-                            history_messages.append(HumanMessage(content=msg.message))
-                        elif msg.sender == 'agent':
-                            history_messages.append(AIMessage(content=msg.message))
-                        elif msg.sender == 'agent_tool_call':
-                            # Rebuild AIMessage with tool_calls from JSON
-                            tool_calls = json.loads(msg.message)
-                            history_messages.append(AIMessage(content="", tool_calls=tool_calls))
-                        elif msg.sender == 'tool':
-                            # Rebuild ToolMessage from JSON
-                            tool_data = json.loads(msg.message)
-                            history_messages.append(ToolMessage(content=tool_data['content'], tool_call_id=tool_data['tool_call_id']))
-                
-                update_payload = {
-                    "messages": history_messages,
-                    "patient": patient,
-                    "conversation_id": conversation_id,
-                }
-                logger.info(f"Updating state for conversation {conversation_id} with {len(history_messages)} messages and patient info.")
-                await agent.aupdate_state(config, update_payload, START)
-
-            # Add the new user message to the database
-            db.add_message(conversation_id=conversation_id, sender="user", message=message)
-
-            # Invoke the agent with the new message
-            response = await agent.ainvoke({"messages": [HumanMessage(content=message)]}, config)
-
-            # Find the index of the last HumanMessage to identify messages from this turn.
-            last_human_message_index = -1
-            for i, msg in reversed(list(enumerate(response["messages"]))):
-                if isinstance(msg, HumanMessage):
-                    last_human_message_index = i
-                    break
-
-            # Process and save all messages generated by the agent in the current turn.
-            if last_human_message_index != -1:
-                messages_this_turn = response["messages"][last_human_message_index + 1:]
+            if cached_reply:
+                logger.info("Answering conversation %s from the turn cache", conversation_id)
+                pending.append(("agent", cached_reply))
+                await send_message(patient_phone_for_reply, cached_reply)
+
+                # Record the turn in the agent state as if the graph had produced it
+                now = datetime.now()
+                await agent.aupdate_state(
+                    config,
+                    {
+                        "messages": [HumanMessage(content=message), AIMessage(content=cached_reply)],
+                        "last_interaction_time": now,
+                    },
+                    "update_timestamp",
+                )
+                _touch_thread(str(conversation_id), now)
+            else:
+                # Invoke the agent with the new message
+                response = await agent.ainvoke({"messages": [HumanMessage(content=message)]}, config)
+
+                # Everything after the prior history and the HumanMessage we just sent belongs to this turn.
+                messages_this_turn = response["messages"][pre_len + 1:]
                 for msg in messages_this_turn:
                     if isinstance(msg, AIMessage):
                         if msg.tool_calls:
                             # Persist the agent's decision to call a tool by saving the tool_calls list as JSON
-                            db.add_message(
-                                conversation_id=conversation_id,
-                                sender="agent_tool_call",
-                                message=json.dumps(msg.tool_calls)
-                            )
+                            pending.append(("agent_tool_call", orjson.dumps(msg.tool_calls).decode()))
                         elif msg.content:
                             # This is the final text reply for the user
-                            db.add_message(conversation_id=conversation_id, sender="agent", message=msg.content)
-                            send_message(patient_phone_for_reply, msg.content)
+                            pending.append(("agent", msg.content))
+                            await send_message(patient_phone_for_reply, msg.content)
                     elif isinstance(msg, ToolMessage):
                         # Persist the tool result by saving its content and ID as JSON
                         tool_data = {"content": msg.content, "tool_call_id": msg.tool_call_id}
-                        db.add_message(
-                            conversation_id=conversation_id,
-                            sender="tool",
-                            message=json.dumps(tool_data)
-                        )
-            else:
-                # Fallback for cases where no new agent messages were generated after the user's.
-                reply = response["messages"][-1].content
-                db.add_message(conversation_id=conversation_id, sender="agent", message=reply)
-                send_message(patient_phone_for_reply, reply)
+                        pending.append(("tool", orjson.dumps(tool_data).decode()))
+
+                # A single plain reply is reusable, unless it echoes something patient-specific
+                if cache_key and len(messages_this_turn) == 1:
+                    reply = messages_this_turn[0]
+                    if (isinstance(reply, AIMessage) and not reply.tool_calls
+                            and isinstance(reply.content, str) and reply.content
+                            and patient.phone_number not in reply.content):
+                        _store_cached_reply(cache_key, reply.content)
+        finally:
+            # Written after the replies are sent so a slow commit never delays the user
+            await _db(db.add_messages, [(conversation_id, *row) for row in pending])
 
-        except Exception as e:
-            logger.error(f"[Agent Error] Failed to process message for conversation {conversation_id}: {e}", exc_info=True)
+    except Exception as e:
+        logger.error("[Agent Error] Failed to process message for conversation %s: %s", conversation_id, e, exc_info=True)
 
+
+async def _conversation_worker(agent, patient_phone: str, inbox: asyncio.Queue, turn_slots: asyncio.Semaphore,
+                               debounce_seconds: float):
+    """
+    Processes a patient's inbox in order, one turn at a time, and exits once it is empty.
+    Being the only consumer of the inbox keeps turns of a conversation sequential, while
+    workers of different patients run concurrently, bounded by turn_slots.
+    """
+    while not inbox.empty():
+        first = inbox.get_nowait()
+        # Short messages sent back to back are answered as a single turn
+        burst = await _collect_burst(inbox, first, debounce_seconds)
+        try:
+            async with turn_slots:
+                await _process_turn(agent, patient_phone, "\n".join(task["message"] for task in burst), first["timestamp"])
         finally:
-            message_queue.task_done()
+            for _ in burst:
+                message_queue.task_done()
+    # No await between the emptiness check and this, so no message can slip in unseen
+    del _inboxes[patient_phone]
+
+
+async def consume_messages(agent):
+    """
+    Continuously consumes messages from the queue and dispatches them to per-patient workers.
+    Messages a patient sends within MESSAGE_DEBOUNCE_SECONDS of each other are coalesced
+    into a single agent turn. Up to AGENT_MAX_CONCURRENT_TURNS turns of different patients
+    are processed concurrently; a patient's own messages are always handled in order.
+    Args:
+        agent: The StateGraph agent to process messages.
+    """
+    logger.info("Starting message consumer...")
+    debounce_seconds = float(os.getenv("MESSAGE_DEBOUNCE_SECONDS", 1.5))
+    turn_slots = asyncio.Semaphore(int(os.getenv("AGENT_MAX_CONCURRENT_TURNS", 8)))
+
+    while True:
+        logger.debug("Waiting for new message in queue...")
+        task = await message_queue.get()
+        patient_phone = task["phone"]
+        inbox = _inboxes.get(patient_phone)
+        if inbox is None:
+            inbox = _inboxes[patient_phone] = asyncio.Queue()
+            inbox.put_nowait(task)
+            worker = asyncio.create_task(_conversation_worker(agent, patient_phone, inbox, turn_slots, debounce_seconds))
+            _workers.add(worker)
+            worker.add_done_callback(_workers.discard)
+        else:
+            inbox.put_nowait(task)
+
+
+async def _index_untracked_threads(checkpointer) -> None:
+    """
+    Adds checkpointer threads missing from the timeout index, e.g. a conversation whose turn
+    failed before update_timestamp ran. A single pass over the checkpoints reads each thread's
+    last interaction straight from its latest checkpoint, without a per-thread aget_state.
+    Threads that never recorded an interaction are indexed as of now, so they are closed
+    after one more timeout interval without activity.
+    """
+    seen = set()
+    async for item in checkpointer.alist(None):
+        thread_id = item.config["configurable"]["thread_id"]
+        # Checkpoints are listed newest first, so the first one seen per thread is its latest
+        if thread_id in seen:
+            continue
+        seen.add(thread_id)
+        if thread_id in _last_interaction:
+            continue
+
+        last_interaction = item.checkpoint["channel_values"].get("last_interaction_time")
+        if isinstance(last_interaction, str):
+            last_interaction = datetime.fromisoformat(last_interaction)
+        logger.info("Found untracked thread %s in checkpointer. Adding it to the timeout index.", thread_id)
+        _touch_thread(thread_id, last_interaction or datetime.now())
 
 
 async def conversation_cleanup_task(agent):
     """
     Periodically checks for timed-out conversations and closes them.
     A conversation is considered timed out if there has been no interaction for a specified interval.
+    Only threads whose last interaction is older than the interval are visited, by popping
+    the timeout index until its oldest entry is still fresh. Threads missing from the index
+    are picked up by one bulk pass over the checkpointer first.
     This function runs indefinitely as a background task.
     Args:
         agent: The StateGraph agent whose checkpointer is used to track conversations.
-        interval_minutes: The interval in minutes to check for timed-out conversations.
     """
     logger.info("Starting conversation cleanup task...")
     interval_minutes=int(os.getenv("CONVERSATION_TIMEOUT_MINUTES", 30))
@@ -274,59 +487,41 @@ async def conversation_cleanup_task(agent):
             logger.warning("Agent has no checkpointer. Skipping cleanup.")
             continue
 
-        # create a set of thread_ids to avoid modifying the dict while iterating
-        all_thread_ids = set()
-        try:
-            for item in checkpointer.list(None):
-                config = item.config
-                thread_id = config["configurable"]["thread_id"]
-                all_thread_ids.add(thread_id)
-                
-        except Exception as e:
-            logger.error(f"Error listing threads from checkpointer: {e}", exc_info=True)
-
-        if not all_thread_ids:
-            logger.info("No active conversation threads found in checkpointer.")
-            continue
-
         try:
-            logger.debug(f"Current active threads in checkpointer: {all_thread_ids}")
-            for thread_id in all_thread_ids:
-                config = {"configurable": {"thread_id": thread_id}}
-                state = await agent.aget_state(config)
-                logger.debug(f"Checking thread {thread_id} with state: {state}")
-                if state and state.values and state.values.get("last_interaction_time"):
-                    last_interaction = state.values["last_interaction_time"]
-                    if isinstance(last_interaction, str):
-                        last_interaction = datetime.fromisoformat(last_interaction)
-
-                    if (datetime.now() - last_interaction).total_seconds() > (interval_minutes * 60):
-                        logger.info(f"Conversation thread {thread_id} has timed out.")
-                        # Check DB status before closing to avoid race conditions
-                        conversation = db.get_conversation(int(thread_id))
-                        if conversation and conversation.status == 'open':
-                            logger.info(f"Closing conversation {thread_id} in DB with reason 'timed_out'.")
-                            db.close_conversation(int(thread_id), reason="timed_out")
-                        else:
-                            logger.info(f"Conversation {thread_id} already closed in DB, skipping DB update.")
-
-                        # delete the thread from the checkpointer
-                        checkpointer.delete_thread(thread_id)
-                        logger.info(f"Removed thread {thread_id} from agent checkpointer.")
-
-                # Also clean up threads that have no state or interaction time, but are lingering
-                elif not state or not state.values:
-                    checkpointer.delete_thread(thread_id)
-                    logger.info(f"Found lingering empty thread {thread_id}. Cleaning up.")
-
+            await _index_untracked_threads(checkpointer)
         except Exception as e:
-            logger.error(f"Error during cleanup for thread {thread_id}: {e}", exc_info=True)
+            logger.error("Error listing threads from checkpointer: %s", e, exc_info=True)
+
+        cutoff = datetime.now() - timedelta(minutes=interval_minutes)
+        while _timeout_index and _timeout_index[0][0] < cutoff:
+            last_interaction, thread_id = heapq.heappop(_timeout_index)
+            if _last_interaction.get(thread_id) != last_interaction:
+                # Superseded by a newer interaction that has its own heap entry
+                continue
+            del _last_interaction[thread_id]
+
+            try:
+                logger.info("Conversation thread %s has timed out.", thread_id)
+                # Check DB status before closing to avoid race conditions
+                conversation = await _db(db.get_conversation, int(thread_id))
+                if conversation and conversation.status == 'open':
+                    logger.info("Closing conversation %s in DB with reason 'timed_out'.", thread_id)
+                    await _db(db.close_conversation, int(thread_id), reason="timed_out")
+                else:
+                    logger.info("Conversation %s already closed in DB, skipping DB update.", thread_id)
+
+                # delete the thread from the checkpointer
+                checkpointer.delete_thread(thread_id)
+                logger.info("Removed thread %s from agent checkpointer.", thread_id)
+
+            except Exception as e:
+                logger.error("Error during cleanup for thread %s: %s", thread_id, e, exc_info=True)
 
 
 async def main():
     # Ensure the database is initialized before starting the agent
     logger.info("Checking and initializing database...")
-    db.init_db(seed=True)
+    await _db(db.init_db, seed=True)
 
     # start up the MCP server locally and run our agent
     async with stdio_client(server_params) as (read, write):
@@ -334,9 +529,10 @@ async def main():
             # Initialize the connection
             await session.initialize()
             tools = await load_mcp_tools(session)
-            logger.debug(f"Loaded MCP tools: {[tool.name for tool in tools]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Loaded MCP tools: %s", [tool.name for tool in tools])
 
-            agent = await create_graph(session)
+            agent = await create_graph(session, tools=tools)
     
             # Start the background cleanup task
             asyncio.create_task(conversation_cleanup_task(agent))
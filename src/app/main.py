@@ -1,7 +1,6 @@
 import logging
-import json
+import orjson
 import hmac
-import hashlib
 import os, getpass
 import asyncio
 from dotenv import load_dotenv
@@ -25,6 +24,9 @@ _set_env("GRAPH_API_VERSION")
 _set_env("META_PHONE_NUMBER_ID")
 _set_env("META_VERIFY_TOKEN")
 
+# Webhook signing key, encoded once instead of on every request
+_APP_SECRET = os.environ["META_APP_SECRET"].encode("latin-1")
+
 # Get a logger for this module
 logger = logging.getLogger(__name__)
 
@@ -32,30 +34,43 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup_event():
+    whatsapp.init()
     logger.info("Starting agent consumer process in the background...")
     asyncio.create_task(agent_process.main())
 
 
-def verify_signature(request: Request):
+@app.on_event("shutdown")
+async def shutdown_event():
+    await whatsapp.close_client()
+
+
+async def verify_signature(request: Request) -> bytes:
     logger.debug("Verifying request signature")
 
     signature = request.headers.get("X-Hub-Signature-256", "")[7:]
+    try:
+        signature_bytes = bytes.fromhex(signature)
+    except ValueError:
+        logger.error("Malformed request signature")
+        raise HTTPException(status_code=400, detail="signature is malformed")
 
-    async def get_body():
-        return await request.body()
-
-    body = asyncio.run(get_body())
+    body = await request.body()
 
-    digest = hmac.new(
-        bytes(os.environ.get("META_APP_SECRET"), "latin-1"),
-        msg=body,
-        digestmod=hashlib.sha256,
-    ).hexdigest()
+    digest = hmac.digest(_APP_SECRET, body, "sha256")
 
-    if not hmac.compare_digest(digest, signature):
+    if not hmac.compare_digest(digest, signature_bytes):
         logger.error("Signature verification failed!")
         raise HTTPException(status_code=403, detail="signature is not valid")
-    return True
+    return body
+
+
+async def webhook_body(body: bytes = Depends(verify_signature)) -> dict:
+    """Parses the already verified raw request body, so it is read and decoded only once."""
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        logger.error("Failed to decode JSON from request body")
+        raise HTTPException(status_code=400, detail="Invalid JSON provided in request body")
 
 
 @app.get("/webhook")
@@ -79,27 +94,24 @@ async def verify_webhook(request: Request):
 
 
 @app.post("/webhook")
-async def receive_webhook(request: Request, signature_valid: bool = Depends(verify_signature)):
+async def receive_webhook(body: dict = Depends(webhook_body)):
     logger.debug("Received a POST request on /webhook")
 
-    try:
-        body = await request.json()
-    except json.JSONDecodeError:
-        logger.error("Failed to decode JSON from request body")
-        raise HTTPException(status_code=400, detail="Invalid JSON provided in request body")
+    logger.debug("request body: %s", body)
 
-    logger.debug(f"request body: {body}")
+    # Walk down to the change payload once and inspect that
+    value = whatsapp.extract_value(body)
 
     # Respond to status updates (like message delivered, read etc.)
-    if whatsapp.is_status_update(body):
-        status = whatsapp.parse_status_update(body)
-        logger.debug(f"Received a WhatsApp status update event. status = {status.get('status')}")
+    if whatsapp.is_status_update(value):
+        status = whatsapp.parse_status_update(value)
+        logger.debug("Received a WhatsApp status update event. status = %s", status.get('status'))
         return {"status": "ok"}
 
     try:
-        if whatsapp.is_valid_message(body):
-            phone_number, message_body = whatsapp.parse_phone_and_message(body)
-            logger.info(f"Incoming message from {phone_number}: {message_body}")
+        if whatsapp.is_valid_message(value):
+            phone_number, message_body = whatsapp.parse_phone_and_message(value)
+            logger.info("Incoming message from %s: %s", phone_number, message_body)
             await agent_process.enqueue_message(phone_number, message_body)
 
             return {"status": "ok"}
@@ -108,7 +120,7 @@ async def receive_webhook(request: Request, signature_valid: bool = Depends(veri
             raise HTTPException(status_code=404, detail="Invalid WhatsApp message structure")
         
     except Exception as e:
-        logger.error(f"Error processing message: {e}")
+        logger.error("Error processing message: %s", e)
         raise HTTPException(status_code=400, detail="Error processing message")
 
 
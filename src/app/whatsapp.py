@@ -1,60 +1,67 @@
 import logging
 from fastapi import HTTPException
-import json
 import re
-import requests
+import httpx
+import orjson
 import os
 
 logger = logging.getLogger(__name__)
 
+# Graph API settings and shared client, set up by init() on app startup
+# so TCP/TLS connections are reused across sends
+_MESSAGES_PATH = ""
+_client: httpx.AsyncClient | None = None
 
-def is_status_update(body):
+# One fused pattern for format_message_content: 【...】 blocks | **bold** | ~~strikethrough~~
+_MARKDOWN_PATTERN = re.compile(r"【.*?】|\*\*(.*?)\*\*|~~(.*?)~~")
+
+
+def extract_value(body):
     """
-    Check if the incoming webhook event is a WhatsApp status update.
+    Return the "value" dict of the first change in a webhook event, or None if it is missing.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("statuses")
-    )
+    try:
+        if not body["object"]:
+            return None
+        return body["entry"][0]["changes"][0]["value"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def is_status_update(value):
+    """
+    Check if the webhook event value is a WhatsApp status update.
+    """
+    return bool(value and value.get("statuses"))
 
 
-def parse_status_update(body):
+def parse_status_update(value):
     """
-    Parse the WhatsApp status update from the webhook event.
+    Parse the WhatsApp status update from the webhook event value.
     """
     try:
-        status = body["entry"][0]["changes"][0]["value"]["statuses"][0]
-        logger.debug(f"WhatsApp Status - {status}")
+        status = value["statuses"][0]
+        logger.debug("WhatsApp Status - %s", status)
         return status
     
     except Exception as e:
-        logger.error(f"Error parsing status update: {e}")
+        logger.error("Error parsing status update: %s", e)
         raise HTTPException(status_code=400, detail="Invalid WhatsApp status update structure")
     
 
-def is_valid_message(body):
+def is_valid_message(value):
     """
-    Check if the incoming webhook event is a valid WhatsApp message.
+    Check if the webhook event value is a valid WhatsApp message.
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    )
+    return bool(value and value.get("messages"))
 
 
-def parse_phone_and_message(body):
+def parse_phone_and_message(value):
     """
-    Parse the phone number and message body from the WhatsApp webhook event.
+    Parse the phone number and message body from the WhatsApp webhook event value.
     """
     try:
-        obj = body["entry"][0]["changes"][0]["value"]["messages"][0]
+        obj = value["messages"][0]
 
         phone_number = obj["from"]  # extract the phone number of the sender
         msg_type = obj["type"]  # extract the type of message
@@ -65,66 +72,77 @@ def parse_phone_and_message(body):
         return phone_number, message_body
     
     except Exception as e:
-        logger.error(f"Error parsing phone number and message: {e}")
+        logger.error("Error parsing phone number and message: %s", e)
         raise HTTPException(status_code=400, detail="Invalid WhatsApp message structure")
 
 
-def send_message(phone_number, message):
+def init():
+    """
+    Reads the Graph API settings and creates the shared async HTTP client.
+    Must be called once the META_* and GRAPH_API_VERSION env vars are available.
+    """
+    global _MESSAGES_PATH, _client
+    _MESSAGES_PATH = f"/{os.environ['META_PHONE_NUMBER_ID']}/messages"
+    _client = httpx.AsyncClient(
+        base_url=f"https://graph.facebook.com/{os.environ['GRAPH_API_VERSION']}",
+        headers={
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {os.environ['META_ACCESS_TOKEN']}",
+        },
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20),
+    )
+
+
+async def close_client():
+    """Closes the shared HTTP client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def send_message(phone_number, message):
     message = format_message_content(message)
-    data = json.dumps({
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": phone_number,
-            "type": "text",
-            "text": {"preview_url": False, "body": message},
-        })
-
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {os.environ.get('META_ACCESS_TOKEN')}",
-    }
-
-    api_version = os.environ.get("GRAPH_API_VERSION")
-    phone_id = os.environ.get("META_PHONE_NUMBER_ID")
-    url = f"https://graph.facebook.com/{api_version}/{phone_id}/messages"
+    data = orjson.dumps({
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": phone_number,
+        "type": "text",
+        "text": {"preview_url": False, "body": message},
+    })
 
     try:
-        response = requests.post(url, data=data, headers=headers)  
+        # Content-type is already set on the client, so the serialized bytes go out as-is
+        response = await _client.post(_MESSAGES_PATH, content=data)
         response.raise_for_status()
-    except requests.Timeout:
+    except httpx.TimeoutException:
         logger.error("Whatsapp send message request timed out")
         raise HTTPException(status_code=408, detail="Request Timeout")
-    except requests.RequestException as e:
-        logger.error(f"Internal Server Error, failed to send message : {e}")
+    except httpx.HTTPError as e:
+        logger.error("Internal Server Error, failed to send message : %s", e)
         raise HTTPException(status_code=500, detail="Internal Server Error, failed to send message")
     else:
-        logger.debug(f"send_message - status: {response.status_code}")
-        logger.info(f"Outgoing message to {phone_number}: {message}")
+        logger.debug("send_message - status: %s", response.status_code)
+        logger.info("Outgoing message to %s: %s", phone_number, message)
 
         return response
 
 
+def _replace_markdown(match: re.Match) -> str:
+    # The inner text is formatted too, so nested styles and 【...】 blocks inside them are handled
+    if match.lastindex == 1:
+        return f"*{_MARKDOWN_PATTERN.sub(_replace_markdown, match.group(1))}*"
+    if match.lastindex == 2:
+        return f"~{_MARKDOWN_PATTERN.sub(_replace_markdown, match.group(2))}~"
+    return ""
+
+
 def format_message_content(text: str) -> str:
     """
     Cleans and converts input text into WhatsApp-compatible formatting.
     - Removes 【...】 blocks
-    - Converts Markdown styles to WhatsApp equivalents
+    - Converts Markdown bold (**text**) and strikethrough (~~text~~) to WhatsApp equivalents
+    Italics (_text_) and inline code (`text`) are identical in both and left untouched.
     """
-
-    # 1. Remove brackets and their content 【...】
-    text = re.sub(r"\【.*?\】", "", text).strip()
-
-    # 2. Convert Markdown bold (**text**) → WhatsApp bold (*text*)
-    text = re.sub(r"\*\*(.*?)\*\*", r"*\1*", text)
-
-    # 3. Convert Markdown italics (_text_) → WhatsApp italics (_text_)
-    # (ensure it doesn't conflict with bold/underscore usage)
-    text = re.sub(r"_(.*?)_", r"_\1_", text)
-
-    # 4. Convert Markdown strikethrough (~~text~~) → WhatsApp (~text~)
-    text = re.sub(r"~~(.*?)~~", r"~\1~", text)
-
-    # 5. Convert Markdown inline code (`text`) → WhatsApp monospace (`text`)
-    text = re.sub(r"`(.*?)`", r"`\1`", text)
-
-    return text
+    return _MARKDOWN_PATTERN.sub(_replace_markdown, text).strip()
@@ -1,30 +1,45 @@
 # mcp/server.py
 import argparse
-import json
 import logging
 import os
 import sys
-from contextlib import suppress
+import time
 from datetime import datetime
-from typing import Optional, Any, Dict, List
+from typing import Annotated, Optional, Any, Dict, List
 
-from pydantic import BaseModel, Field, ValidationError
+from pydantic import AfterValidator, BaseModel, ConfigDict, Field
 
 # MCP library (install 'mcp' package)
 from mcp.server.fastmcp import FastMCP
 
 # Shared DB layer and Pydantic models you already created
 from shared import db as shared_db
-from shared.models import Dentist, Patient, Appointment
+from shared.logger_config import install_queue_listener
+from shared.models import Patient, Appointment
 
 logger = logging.getLogger(__name__)
 
 # region --- Pydantic Payloads for Tools ---
 # While shared.models defines the DB schema, these payloads define the API for the tools.
 # They can be slightly different, e.g. accepting whatsapp_number instead of patient_id.
+# defer_build skips building each payload's own validator at class creation; FastMCP still builds
+# the tool argument schemas (with the payloads inlined) when @mcp.tool() registers them at import.
 
-class UpdatePatientPayload(Patient):
+def _to_local_naive(value: datetime) -> datetime:
+    """A time with a UTC offset as the same instant in naive server-local time; naive ones as-is."""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+# Appointment times are stored and reported as naive server-local time (like get_current_time),
+# so an offset the model includes is converted at the boundary instead of being dropped later
+LocalDateTime = Annotated[datetime, AfterValidator(_to_local_naive)]
+_LOCAL_TIME_NOTE = " Times are in the clinic's local time; one with a UTC offset is converted to it."
+
+
+class UpdatePatientPayload(BaseModel):
     """Payload to update a patient's profile. Uses whatsapp_number for identification."""
+    model_config = ConfigDict(defer_build=True)
+
     whatsapp_number: str = Field(..., description="The patient's WhatsApp number (including country code).")
     name: Optional[str] = Field(None, description="The patient's full name.")
     age: Optional[int] = Field(None, description="The patient's age.")
@@ -33,9 +48,11 @@ class UpdatePatientPayload(Patient):
 
 class BookAppointmentPayload(BaseModel):
     """Payload for booking a new appointment."""
+    model_config = ConfigDict(defer_build=True)
+
     patient_whatsapp: str = Field(..., description="The patient's WhatsApp number.")
     dentist_id: int = Field(..., description="The ID of the dentist for the appointment.")
-    appointment_time: str = Field(..., description="The desired appointment time in ISO 8601 format (e.g., '2025-08-31T14:30:00').")
+    appointment_time: LocalDateTime = Field(..., description="The desired appointment time in ISO 8601 format (e.g., '2025-08-31T14:30:00')." + _LOCAL_TIME_NOTE)
     patient_name: Optional[str] = Field(None, description="The patient's full name (required if the patient is new).")
     patient_age: Optional[int] = Field(None, description="The patient's age (optional, for new patients).")
     patient_gender: Optional[str] = Field(None, description="The patient's gender (optional, for new patients).")
@@ -43,20 +60,26 @@ class BookAppointmentPayload(BaseModel):
 
 class CancelAppointmentPayload(BaseModel):
     """Payload for cancelling an appointment. Can use either appointment_id or a combination of other details."""
+    model_config = ConfigDict(defer_build=True)
+
     appointment_id: Optional[int] = Field(None, description="The unique ID of the appointment to cancel.")
     patient_whatsapp: Optional[str] = Field(None, description="The patient's WhatsApp number (used if appointment_id is unknown).")
     dentist_id: Optional[int] = Field(None, description="The dentist's ID (used if appointment_id is unknown).")
-    appointment_time: Optional[str] = Field(None, description="The appointment time in ISO 8601 format (used if appointment_id is unknown).")
+    appointment_time: Optional[LocalDateTime] = Field(None, description="The appointment time in ISO 8601 format (used if appointment_id is unknown)." + _LOCAL_TIME_NOTE)
 
 
 class ReschedulePayload(BaseModel):
     """Payload for rescheduling an existing appointment."""
+    model_config = ConfigDict(defer_build=True)
+
     appointment_id: int = Field(..., description="The unique ID of the appointment to reschedule.")
-    new_appointment_time: str = Field(..., description="The new desired appointment time in ISO 8601 format.")
+    new_appointment_time: LocalDateTime = Field(..., description="The new desired appointment time in ISO 8601 format." + _LOCAL_TIME_NOTE)
 
 
 class CloseConversationPayload(BaseModel):
     """Payload for closing a conversation."""
+    model_config = ConfigDict(defer_build=True)
+
     conversation_id: int = Field(..., description="The ID of the conversation to close.")
     reason: str = Field("user_confirmed", description="The reason for closing the conversation.")
 
@@ -99,50 +122,77 @@ def system_prompt() -> str:
 # -------------------------
 # Utility helpers
 # -------------------------
-def _ensure_patient(whatsapp: str, name: Optional[str] = None, age: Optional[int] = None, gender: Optional[str] = None) -> Patient:
-    """Finds a patient by WhatsApp number. If not found, creates a new patient record."""
-    patient = shared_db.get_patient_by_phone(whatsapp)
-    if patient:
-        return patient
-    
-    if not name:
-        raise ValueError("Patient name is required for new patient registration.")
-
+def _create_patient(whatsapp: str, name: Optional[str] = None, age: Optional[int] = None, gender: Optional[str] = None, conn=None) -> Patient:
+    """Creates a new patient record for a WhatsApp number that has none yet."""
     new_patient_data = Patient(phone_number=whatsapp, name=name, age=age, gender=gender)
-    return shared_db.create_patient(new_patient_data)
+    return shared_db.create_patient(new_patient_data, conn=conn)
+
+
+def _appointment_dict(row: Dict[str, Any]) -> Dict[str, Any]:
+    """An appointment dict for a tool result, with its time as ISO 8601."""
+    row["appointment_time"] = row["appointment_time"].isoformat()
+    return row
+
+
+# Dentist existence, the patient's id and a slot clash, looked up in one round trip
+_BOOKING_CHECK_SQL = """
+SELECT
+    (SELECT 1 FROM dentists WHERE id = ?),
+    (SELECT id FROM patients WHERE phone_number = ?),
+    (SELECT 1 FROM appointments WHERE dentist_id = ? AND appointment_time = ? AND status = 'scheduled')
+"""
+
+
+# UPDATE statement for each combination of provided profile fields, keyed by bitmask (name=1, age=2, gender=4)
+_PATIENT_FIELDS = ("name", "age", "gender")
+_UPDATE_PATIENT_SQL = {
+    mask: "UPDATE patients SET "
+    + ", ".join(f"{col} = ?" for bit, col in enumerate(_PATIENT_FIELDS) if mask >> bit & 1)
+    + " WHERE id = ?"
+    for mask in range(1, 1 << len(_PATIENT_FIELDS))
+}
+
+
+# (epoch second, ISO string) of the last get_current_time answer
+_current_time_cache: tuple[int, str] = (0, "")
 
 
 # -------------------------
 # MCP Tools
 # -------------------------
+# Results go out as text content only: the agent reads the text, and structured output would
+# validate, dump and send every result a second time.
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def get_current_time() -> str:
     """
     Returns the current date and time in ISO 8601 format.
     This must be called before any time-sensitive operations like booking, rescheduling or cancelling
     to ensure the agent has accurate knowledge of the present moment.
     """
-    now = datetime.now().isoformat()
+    global _current_time_cache
+    sec = int(time.time())
+    cached_sec, now = _current_time_cache
+    if sec != cached_sec:
+        # Second resolution, so calls within the same second reuse the string
+        now = datetime.fromtimestamp(sec).isoformat()
+        _current_time_cache = (sec, now)
     logger.debug("Tool: get_current_time, returning: %s", now)
     return now
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def list_dentists(specialization: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Retrieves a list of all available dentists. 
     You can optionally filter the list by specialization (e.g., 'Orthodontist', 'Endodontist').
     """
     logger.debug("Tool: list_dentists, specialization=%s", specialization)
-    dentists = shared_db.get_all_dentists()
     if specialization:
-        filtered = [d for d in dentists if specialization.lower() in d.specialization.lower()]
-    else:
-        filtered = dentists
-    return [d.model_dump() for d in filtered]
+        return [dict(row) for row in shared_db.list_dentists_raw(specialization)]
+    return shared_db.get_all_dentists_dumped()
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def get_dentist_profile(dentist_id: Optional[int] = None, name: Optional[str] = None) -> Dict[str, Any]:
     """
     Gets the detailed profile of a specific dentist, either by their unique ID or by their name.
@@ -150,29 +200,32 @@ def get_dentist_profile(dentist_id: Optional[int] = None, name: Optional[str] =
     """
     logger.debug("Tool: get_dentist_profile, id=%s, name=%s", dentist_id, name)
     if dentist_id:
-        dentist = shared_db.get_dentist(dentist_id)
-        return dentist.model_dump() if dentist else {"error": "dentist_not_found"}
+        return shared_db.get_dentist_dumped(dentist_id) or {"error": "dentist_not_found"}
     if name:
-        with shared_db.db() as conn:
-            row = conn.execute("SELECT * FROM dentists WHERE name LIKE ? LIMIT 1", (f"%{name}%",)).fetchone()
+        with shared_db.read_conn() as conn:
+            row = conn.execute(
+                "SELECT id, name, specialization, languages_spoken, qualifications, years_experience, availability_schedule"
+                " FROM dentists WHERE name LIKE ? LIMIT 1",
+                (f"%{name}%",),
+            ).fetchone()
             if row:
                 return dict(row)
     return {"error": "A dentist_id or name must be provided."}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def get_availability(dentist_id: int) -> Dict[str, Any]:
     """
     Fetches the weekly availability schedule for a specific dentist, identified by their ID.
     """
     logger.debug("Tool: get_availability, dentist_id=%s", dentist_id)
-    dentist = shared_db.get_dentist(dentist_id)
+    dentist = shared_db.get_dentist_dumped(dentist_id)
     if not dentist:
         return {"error": "dentist_not_found"}
-    return {"availability_schedule": dentist.availability_schedule}
+    return {"availability_schedule": dentist["availability_schedule"]}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def update_patient_profile(payload: UpdatePatientPayload) -> Dict[str, Any]:
     """
     Updates a patient's profile details (name, age, gender) using their WhatsApp number.
@@ -180,35 +233,25 @@ def update_patient_profile(payload: UpdatePatientPayload) -> Dict[str, Any]:
     """
     logger.debug("Tool: update_patient_profile, payload=%s", payload)
     with shared_db.db() as conn:
-        patient_row = conn.execute("SELECT * FROM patients WHERE phone_number = ?", (payload.whatsapp_number,)).fetchone()
+        patient_row = conn.execute("SELECT id FROM patients WHERE phone_number = ?", (payload.whatsapp_number,)).fetchone()
         if not patient_row:
             return {"error": "patient_not_found", "details": f"No patient with WhatsApp number {payload.whatsapp_number}"}
         
         patient_id = patient_row["id"]
-        updates = []
-        params = []
-        if payload.name is not None:
-            updates.append("name = ?")
-            params.append(payload.name)
-        if payload.age is not None:
-            updates.append("age = ?")
-            params.append(payload.age)
-        if payload.gender is not None:
-            updates.append("gender = ?")
-            params.append(payload.gender)
-
-        if not updates:
+        name, age, gender = payload.name, payload.age, payload.gender
+        mask = (name is not None) | (age is not None) << 1 | (gender is not None) << 2
+
+        if not mask:
             return {"error": "no_update_fields_provided", "details": "You must provide at least one field to update."}
 
-        params.append(patient_id)
-        query = f"UPDATE patients SET {', '.join(updates)} WHERE id = ?"
-        conn.execute(query, tuple(params))
+        params = tuple(v for v in (name, age, gender) if v is not None) + (patient_id,)
+        conn.execute(_UPDATE_PATIENT_SQL[mask], params)
 
-    logger.info(f"Updated patient profile for patient id {patient_id}")
+    logger.info("Updated patient profile for patient id %s", patient_id)
     return {"status": "success", "patient_id": patient_id}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def upcoming_appointments(patient_whatsapp: str) -> List[Dict[str, Any]]:
     """
     Returns a list of all upcoming scheduled appointments for a patient, identified by their WhatsApp number.
@@ -218,11 +261,10 @@ def upcoming_appointments(patient_whatsapp: str) -> List[Dict[str, Any]]:
     if not patient:
         return []  # Return an empty list if the patient is not found
     
-    appointments = shared_db.get_patient_appointments(patient.id)
-    return [appt.model_dump() for appt in appointments if appt.status == 'scheduled']
+    return [_appointment_dict(row) for row in shared_db.get_patient_scheduled_appointments(patient.id)]
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def book_appointment(payload: BookAppointmentPayload) -> Dict[str, Any]:
     """
     Books a new appointment for a patient with a specific dentist at a given time.
@@ -230,34 +272,40 @@ def book_appointment(payload: BookAppointmentPayload) -> Dict[str, Any]:
     """
     logger.debug("Tool: book_appointment, payload=%s", payload)
     try:
-        dentist = shared_db.get_dentist(payload.dentist_id)
-        if not dentist:
-            return {"error": "dentist_not_found"}
-
-        patient = _ensure_patient(
-            whatsapp=payload.patient_whatsapp,
-            name=payload.patient_name,
-            age=payload.patient_age,
-            gender=payload.patient_gender
-        )
-
+        # All lookups and inserts share one connection and one write transaction
         with shared_db.db() as conn:
-            clash = conn.execute(
-                "SELECT id FROM appointments WHERE dentist_id = ? AND appointment_time = ? AND status = 'scheduled'",
-                (payload.dentist_id, payload.appointment_time),
+            dentist_exists, patient_id, clash = conn.execute(
+                _BOOKING_CHECK_SQL,
+                (payload.dentist_id, payload.patient_whatsapp, payload.dentist_id, shared_db.to_epoch_ms(payload.appointment_time)),
             ).fetchone()
+
+            if not dentist_exists:
+                return {"error": "dentist_not_found"}
+
+            if patient_id is None and not payload.patient_name:
+                raise ValueError("Patient name is required for new patient registration.")
+
             if clash:
                 return {"error": "slot_unavailable", "details": "The requested time slot is already booked."}
 
+            if patient_id is None:
+                patient_id = _create_patient(
+                    whatsapp=payload.patient_whatsapp,
+                    name=payload.patient_name,
+                    age=payload.patient_age,
+                    gender=payload.patient_gender,
+                    conn=conn,
+                ).id
+
             new_appointment = Appointment(
-                patient_id=patient.id,
+                patient_id=patient_id,
                 dentist_id=payload.dentist_id,
-                appointment_time=datetime.fromisoformat(payload.appointment_time),
+                appointment_time=payload.appointment_time,
                 status='scheduled'
             )
-            created_appt = shared_db.create_appointment(new_appointment)
+            created_appt = shared_db.create_appointment(new_appointment, conn=conn)
 
-        logger.info("Booked appointment id=%s for patient=%s", created_appt.id, patient.id)
+        logger.info("Booked appointment id=%s for patient=%s", created_appt.id, patient_id)
         return created_appt.model_dump()
 
     except ValueError as ve:
@@ -267,7 +315,7 @@ def book_appointment(payload: BookAppointmentPayload) -> Dict[str, Any]:
         return {"error": "internal_server_error", "details": str(e)}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def cancel_appointment(payload: CancelAppointmentPayload) -> Dict[str, Any]:
     """
     Cancels an existing appointment.
@@ -282,55 +330,59 @@ def cancel_appointment(payload: CancelAppointmentPayload) -> Dict[str, Any]:
         return {"error": "not_found", "details": "Appointment ID not found or already cancelled."}
 
     if payload.patient_whatsapp and payload.dentist_id and payload.appointment_time:
-        patient = shared_db.get_patient_by_phone(payload.patient_whatsapp)
-        if not patient:
-            return {"error": "patient_not_found"}
-        
+        # Look up and cancel the matching scheduled appointment in one statement
         with shared_db.db() as conn:
-            # Find the specific appointment to cancel
-            appt_to_cancel = conn.execute(
-                "SELECT id FROM appointments WHERE patient_id=? AND dentist_id=? AND appointment_time=? AND status='scheduled'",
-                (patient.id, payload.dentist_id, payload.appointment_time)
+            cancelled = conn.execute(
+                """
+                UPDATE appointments SET status='cancelled'
+                WHERE id = (
+                    SELECT id FROM appointments
+                    WHERE patient_id=(SELECT id FROM patients WHERE phone_number=?)
+                      AND dentist_id=? AND appointment_time=? AND status='scheduled'
+                    LIMIT 1
+                )
+                RETURNING id
+                """,
+                (payload.patient_whatsapp, payload.dentist_id, shared_db.to_epoch_ms(payload.appointment_time)),
             ).fetchone()
 
-            if not appt_to_cancel:
-                return {"error": "not_found", "details": "No matching scheduled appointment found for the given details."}
-            
-            updated = shared_db.update_appointment_status(appt_to_cancel['id'], 'cancelled')
-            if updated:
-                logger.info("Cancelled appointment id=%s", appt_to_cancel['id'])
-                return {"status": "cancelled", "appointment_id": appt_to_cancel['id']}
+        if not cancelled:
+            return {"error": "not_found", "details": "No matching scheduled appointment found for the given details."}
+
+        logger.info("Cancelled appointment id=%s", cancelled["id"])
+        return {"status": "cancelled", "appointment_id": cancelled["id"]}
 
     return {"error": "invalid_payload", "details": "You must provide either an appointment_id or the trio of patient_whatsapp, dentist_id, and appointment_time."}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def reschedule_appointment(payload: ReschedulePayload) -> Dict[str, Any]:
     """
     Reschedules an existing appointment to a new time. Requires the unique appointment_id.
     """
     logger.debug("Tool: reschedule_appointment, payload=%s", payload)
+    new_time = shared_db.to_epoch_ms(payload.new_appointment_time)
     with shared_db.db() as conn:
-        appt_row = conn.execute("SELECT * FROM appointments WHERE id = ?", (payload.appointment_id,)).fetchone()
+        appt_row = conn.execute("SELECT dentist_id, status FROM appointments WHERE id = ?", (payload.appointment_id,)).fetchone()
         if not appt_row or appt_row["status"] != "scheduled":
             return {"error": "appointment_not_found_or_not_scheduled"}
 
         clash = conn.execute(
             "SELECT id FROM appointments WHERE dentist_id = ? AND appointment_time = ? AND status = 'scheduled' AND id <> ?",
-            (appt_row["dentist_id"], payload.new_appointment_time, payload.appointment_id),
+            (appt_row["dentist_id"], new_time, payload.appointment_id),
         ).fetchone()
         if clash:
             return {"error": "new_slot_unavailable"}
 
         conn.execute(
             "UPDATE appointments SET appointment_time = ?, status = 'rescheduled' WHERE id = ?",
-            (payload.new_appointment_time, payload.appointment_id),
+            (new_time, payload.appointment_id),
         )
     logger.info("Rescheduled appointment id=%s to %s", payload.appointment_id, payload.new_appointment_time)
     return {"status": "rescheduled", "appointment_id": payload.appointment_id}
 
 
-@mcp.tool()
+@mcp.tool(structured_output=False)
 def close_conversation(payload: CloseConversationPayload) -> Dict[str, Any]:
     """
     Closes the current conversation when the user has confirmed they have no more requests.
@@ -339,10 +391,10 @@ def close_conversation(payload: CloseConversationPayload) -> Dict[str, Any]:
     logger.debug("Tool: close_conversation, payload=%s", payload)
     try:
         shared_db.close_conversation(payload.conversation_id, payload.reason)
-        logger.info(f"Conversation {payload.conversation_id} closed by agent with reason: {payload.reason}")
+        logger.info("Conversation %s closed by agent with reason: %s", payload.conversation_id, payload.reason)
         return {"status": "success", "conversation_id": payload.conversation_id}
     except Exception as e:
-        logger.error(f"Failed to close conversation {payload.conversation_id}: {e}", exc_info=True)
+        logger.error("Failed to close conversation %s: %s", payload.conversation_id, e, exc_info=True)
         return {"error": "db_error", "details": str(e)}
 
 
@@ -352,6 +404,8 @@ def close_conversation(payload: CloseConversationPayload) -> Dict[str, Any]:
 def setup_mcp_logging(level=logging.INFO):
     """
     Configures logging specifically for the MCP server process.
+    Records are queued and written to the file and stdout by a listener thread,
+    so tool calls don't block on log I/O.
     """
     log_dir = os.path.join(os.path.dirname(__file__), "..", "..", "logs")
     os.makedirs(log_dir, exist_ok=True)
@@ -369,11 +423,11 @@ def setup_mcp_logging(level=logging.INFO):
 
     file_handler = logging.FileHandler(log_file_path, mode='a')
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
 
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setFormatter(formatter)
-    root_logger.addHandler(stream_handler)
+
+    install_queue_listener(root_logger, file_handler, stream_handler)
 
 
 def main():
@@ -1,11 +1,15 @@
 import os
+import queue
 import sqlite3
 import logging
+import threading
+import time
+from pathlib import Path
 from contextlib import contextmanager
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 from datetime import datetime
 
-from shared.models import Dentist, Patient, Appointment, Message, Conversation, AppointmentWithDetails
+from shared.models import Dentist, Patient, Appointment, Message, Conversation, AppointmentWithDetails, MessageListResponse
 
 logger = logging.getLogger(__name__)
 
@@ -13,70 +17,352 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "../..", "data", "dentaldesk_a
 logger.info("Using DB at: %s", DB_PATH)
 
 
+# Per-connection settings. WAL itself (set in init_db) is persistent in the DB file;
+# with it, NORMAL sync is crash-safe and skips the fsync on every commit. mmap_size and
+# cache_size (in KiB when negative) are upper bounds, not allocations: memory is only
+# used as pages are actually read. busy_timeout makes a write that finds another
+# process (the CLI, the other server) holding the lock wait up to 5s instead of
+# failing at once; it is the same wait sqlite3.connect's default timeout sets, made
+# explicit here next to the rest.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
+    conn.row_factory = sqlite3.Row
+    for pragma in _CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# One writer connection and a pool of read-only connections per process, opened on first
+# use, so compiled statement caches survive across calls. All run in autocommit mode:
+# reads take no transaction and writes scope their own with db(). With WAL, readers
+# and the writer don't block each other.
+_READER_POOL_SIZE = 8
+
+_writer: Optional[sqlite3.Connection] = None
+_writer_lock = threading.RLock()
+_writer_owner: Optional[int] = None
+_writer_depth = 0
+
+_readers: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+_readers_free = threading.Semaphore(_READER_POOL_SIZE)
+
+
+def _open(uri: str) -> sqlite3.Connection:
+    return _configure(sqlite3.connect(
+        uri, uri=True, check_same_thread=False, isolation_level=None, cached_statements=256,
+    ))
+
+
+@contextmanager
+def _writer_conn():
+    """The writer connection, held exclusively by the calling thread, without a transaction."""
+    global _writer, _writer_owner
+    with _writer_lock:
+        if _writer is None:
+            os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+            _writer = _open(Path(DB_PATH).resolve().as_uri())
+        outer_owner, _writer_owner = _writer_owner, threading.get_ident()
+        try:
+            yield _writer
+        finally:
+            _writer_owner = outer_owner
+
+
 @contextmanager
 def db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """
+    Scope a write transaction (BEGIN IMMEDIATE) on the writer connection. Nested db()
+    blocks join the outermost one, which commits on success and rolls back on error.
+    """
+    global _writer_depth
+    with _writer_conn() as conn:
+        if _writer_depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        _writer_depth += 1
+        try:
+            yield conn
+            if _writer_depth == 1:
+                conn.execute("COMMIT")
+        except BaseException:
+            if _writer_depth == 1 and conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            _writer_depth -= 1
+
+
+@contextmanager
+def read_conn():
+    """
+    A pooled read-only connection, without an explicit transaction. A thread that is
+    inside a db() block reads through the writer instead, so it sees its own writes.
+    """
+    if _writer_owner == threading.get_ident():
+        with _writer_conn() as conn:
+            yield conn
+        return
+
+    pool = _readers
+    _readers_free.acquire()
     try:
-        yield conn
-        conn.commit()
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = _open(Path(DB_PATH).resolve().as_uri() + "?mode=ro")
+        try:
+            yield conn
+        finally:
+            pool.put(conn)
     finally:
-        conn.close()
+        _readers_free.release()
+
+
+def close_connection():
+    """Closes the writer and the idle readers; the next call reopens them."""
+    global _writer, _readers
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+    idle, _readers = _readers, queue.SimpleQueue()
+    while True:
+        try:
+            idle.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def now_ms() -> int:
+    """The current time as epoch milliseconds, the form timestamps are stored in."""
+    return time.time_ns() // 1_000_000
+
+
+def to_epoch_ms(dt: datetime) -> int:
+    """Epoch milliseconds for a datetime. Naive values are local time, like datetime.now()."""
+    return int(dt.replace(microsecond=0).timestamp()) * 1000 + dt.microsecond // 1000
+
+
+def from_epoch_ms(ms: int) -> datetime:
+    """Naive local datetime for stored epoch milliseconds; the inverse of to_epoch_ms."""
+    return datetime.fromtimestamp(ms // 1000).replace(microsecond=ms % 1000 * 1000)
+
+
+# Model fields stored as INTEGER epoch milliseconds, converted back into datetimes
+_DATETIME_FIELDS = {
+    Appointment: ("appointment_time",),
+    AppointmentWithDetails: ("appointment_time",),
+    Conversation: ("started_at", "ended_at"),
+    Message: ("created_at",),
+}
+
+
+def _factory(cls, columns: tuple[str, ...]):
+    """
+    Returns a cursor row_factory building `cls` from one of our own rows selected as
+    `columns` (in that order), read positionally from the raw tuple and without
+    re-validation, so no sqlite3.Row is made along the way.
+    """
+    construct = cls.model_construct
+    converted = _DATETIME_FIELDS.get(cls, ())
+    if not converted:
+        return lambda cursor, row: construct(**dict(zip(columns, row)))
+
+    def make(cursor, row):
+        values = dict(zip(columns, row))
+        for field in converted:
+            if values[field] is not None:
+                values[field] = from_epoch_ms(values[field])
+        return construct(**values)
+    return make
+
+
+def _fetch(conn: sqlite3.Connection, row_factory, sql: str, params=()) -> sqlite3.Cursor:
+    """Runs `sql` on a cursor of its own whose rows come back built by `row_factory`."""
+    cur = conn.cursor()
+    cur.row_factory = row_factory
+    return cur.execute(sql, params)
+
+
+# Column order each query selects in, and the matching row -> model factory
+_DENTIST_COLUMNS = ("id", "name", "specialization", "languages_spoken", "qualifications", "years_experience", "availability_schedule")
+_PATIENT_COLUMNS = ("id", "name", "age", "gender", "phone_number")
+_APPOINTMENT_DETAILS_COLUMNS = ("appointment_id", "appointment_time", "status", "dentist_name", "patient_name")
+_CONVERSATION_COLUMNS = ("id", "patient_id", "status", "started_at", "ended_at", "closed_reason")
+_MESSAGE_COLUMNS = ("id", "conversation_id", "sender", "message", "created_at")
+
+_dentist_from_row = _factory(Dentist, _DENTIST_COLUMNS)
+_patient_from_row = _factory(Patient, _PATIENT_COLUMNS)
+_appointment_details_from_row = _factory(AppointmentWithDetails, _APPOINTMENT_DETAILS_COLUMNS)
+_conversation_from_row = _factory(Conversation, _CONVERSATION_COLUMNS)
+_message_from_row = _factory(Message, _MESSAGE_COLUMNS)
+
+_SELECT_DENTISTS = "SELECT " + ", ".join(_DENTIST_COLUMNS) + " FROM dentists"
+_SELECT_PATIENTS = "SELECT " + ", ".join(_PATIENT_COLUMNS) + " FROM patients"
+_SELECT_CONVERSATIONS = "SELECT " + ", ".join(_CONVERSATION_COLUMNS) + " FROM conversations"
+_SELECT_MESSAGES = "SELECT " + ", ".join(_MESSAGE_COLUMNS) + " FROM messages"
+
+# Queries are put together once, here: sqlite3 looks prepared statements up by their SQL
+# text, and a string rebuilt on every call would be hashed and compared in full each time
+_SELECT_DENTIST_BY_ID = _SELECT_DENTISTS + " WHERE id=?"
+_SELECT_DENTISTS_BY_SPECIALIZATION = _SELECT_DENTISTS + " WHERE specialization LIKE ? ESCAPE '\\'"
+_SELECT_PATIENT_BY_ID = _SELECT_PATIENTS + " WHERE id=?"
+_SELECT_PATIENT_BY_PHONE = _SELECT_PATIENTS + " WHERE phone_number=?"
+_SELECT_CONVERSATION_BY_ID = _SELECT_CONVERSATIONS + " WHERE id=?"
+_SELECT_OPEN_CONVERSATIONS = _SELECT_CONVERSATIONS + " WHERE status='open'"
+_SELECT_LATEST_MESSAGES = _SELECT_MESSAGES + " WHERE conversation_id=? ORDER BY id DESC LIMIT ?"
+_SELECT_MESSAGES_BEFORE = _SELECT_MESSAGES + " WHERE conversation_id=? AND id<? ORDER BY id DESC LIMIT ?"
+
+
+@contextmanager
+def _use(conn: Optional[sqlite3.Connection], write: bool = False):
+    """Run on the caller's connection (and transaction) if one is given, else in a new scope."""
+    if conn is not None:
+        yield conn
+    else:
+        with (db() if write else read_conn()) as new_conn:
+            yield new_conn
 
 
 # -----------------------
 # Dentist Queries
 # -----------------------
 def get_all_dentists() -> List[Dentist]:
-    with db() as conn:
-        rows = conn.execute("SELECT * FROM dentists").fetchall()
-        return [Dentist(**dict(row)) for row in rows]
+    """All dentists, from the shared dentist cache. Don't mutate the models."""
+    return list(_dentists_cached()[3])
+
+
+def get_all_dentists_raw() -> List[sqlite3.Row]:
+    """Dentist rows as-is, for read-only callers that don't need validated models."""
+    with read_conn() as conn:
+        return conn.execute(_SELECT_DENTISTS).fetchall()
+
+
+def list_dentists_raw(specialization: Optional[str] = None) -> List[sqlite3.Row]:
+    """Dentist rows whose specialization contains the given text (case-insensitive), or all of them."""
+    if not specialization:
+        return get_all_dentists_raw()
+    pattern = "%" + specialization.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    with read_conn() as conn:
+        return conn.execute(_SELECT_DENTISTS_BY_SPECIALIZATION, (pattern,)).fetchall()
+
+
+def get_dentists_version(conn: Optional[sqlite3.Connection] = None) -> int:
+    """Counter bumped by triggers on every write to dentists, for invalidating cached dentist data."""
+    with _use(conn) as conn:
+        row = conn.execute("SELECT version FROM table_versions WHERE name='dentists'").fetchone()
+        return row[0] if row else 0
+
+
+# How long a cached copy of dentists is served before its version is looked up again
+_DENTISTS_RECHECK_SECONDS = 60.0
+
+# (dentists version, rows as dicts, same dicts by id, models, same models by id);
+# reloaded when the version moves
+_dentists_cache: Optional[tuple[int, List[dict], dict[int, dict], List[Dentist], dict[int, Dentist]]] = None
+_dentists_checked_at = 0.0
+_dentists_lock = threading.Lock()
+
+
+def _dentists_cached() -> tuple[int, List[dict], dict[int, dict], List[Dentist], dict[int, Dentist]]:
+    global _dentists_cache, _dentists_checked_at
+    with _dentists_lock:
+        cache = _dentists_cache
+        if cache is not None and time.monotonic() - _dentists_checked_at < _DENTISTS_RECHECK_SECONDS:
+            return cache
+        with read_conn() as conn:
+            version = get_dentists_version(conn)
+            if cache is None or cache[0] != version:
+                models = _fetch(conn, _dentist_from_row, _SELECT_DENTISTS).fetchall()
+                dumped = [m.model_dump() for m in models]
+                cache = _dentists_cache = (
+                    version, dumped, {d["id"]: d for d in dumped}, models, {m.id: m for m in models},
+                )
+        _dentists_checked_at = time.monotonic()
+        return cache
 
 
-def get_dentist(dentist_id: int) -> Optional[Dentist]:
-    with db() as conn:
-        row = conn.execute("SELECT * FROM dentists WHERE id=?", (dentist_id,)).fetchone()
-        return Dentist(**dict(row)) if row else None
+def get_all_dentists_dumped() -> List[dict]:
+    """All dentists as plain dicts, cached until the dentists table changes. Don't mutate the result."""
+    return _dentists_cached()[1]
+
+
+def get_dentist_dumped(dentist_id: int) -> Optional[dict]:
+    """One dentist as a plain dict from the same cache as get_all_dentists_dumped, or None."""
+    return _dentists_cached()[2].get(dentist_id)
+
+
+def _reset_dentists_cache():
+    """Drops the cached dentists, for writes this process knows about."""
+    global _dentists_cache
+    with _dentists_lock:
+        _dentists_cache = None
+
+
+def get_dentist(dentist_id: int, conn: Optional[sqlite3.Connection] = None) -> Optional[Dentist]:
+    """One dentist from the shared dentist cache, or read on `conn` when inside a transaction."""
+    if conn is None:
+        return _dentists_cached()[4].get(dentist_id)
+    return _fetch(conn, _dentist_from_row, _SELECT_DENTIST_BY_ID, (dentist_id,)).fetchone()
 
 
 # -----------------------
 # Patient Queries
 # -----------------------
-def create_patient(patient: Patient) -> Patient:
-    with db() as conn:
-        cur = conn.execute(
-            "INSERT INTO patients (name, age, gender, phone_number) VALUES (?, ?, ?, ?)",
+def create_patient(patient: Patient, conn: Optional[sqlite3.Connection] = None) -> Patient:
+    with _use(conn, write=True) as conn:
+        patient.id = conn.execute(
+            "INSERT INTO patients (name, age, gender, phone_number) VALUES (?, ?, ?, ?) RETURNING id",
             (patient.name, patient.age, patient.gender, patient.phone_number),
-        )
-        patient.id = cur.lastrowid
+        ).fetchone()[0]
         logger.info("Patient created with id=%s", patient.id)
         return patient
 
 
 def get_patient(patient_id: int) -> Optional[Patient]:
-    with db() as conn:
-        row = conn.execute("SELECT * FROM patients WHERE id=?", (patient_id,)).fetchone()
-        return Patient(**dict(row)) if row else None
+    with read_conn() as conn:
+        return _fetch(conn, _patient_from_row, _SELECT_PATIENT_BY_ID, (patient_id,)).fetchone()
 
 
-def get_patient_by_phone(phone_number: str) -> Optional[Patient]:
-    with db() as conn:
-        row = conn.execute("SELECT * FROM patients WHERE phone_number=?", (phone_number,)).fetchone()
-        return Patient(**dict(row)) if row else None
+def get_patient_by_phone(phone_number: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Patient]:
+    with _use(conn) as conn:
+        return _fetch(conn, _patient_from_row, _SELECT_PATIENT_BY_PHONE, (phone_number,)).fetchone()
 
 
 # -----------------------
 # Appointment Queries
 # -----------------------
-def create_appointment(appt: Appointment) -> Appointment:
+def create_appointment(appt: Appointment, conn: Optional[sqlite3.Connection] = None) -> Appointment:
+    with _use(conn, write=True) as conn:
+        appt.id = conn.execute(
+            "INSERT INTO appointments (patient_id, dentist_id, appointment_time, status) VALUES (?, ?, ?, ?) RETURNING id",
+            (appt.patient_id, appt.dentist_id, to_epoch_ms(appt.appointment_time), appt.status),
+        ).fetchone()[0]
+        logger.info("Appointment created with id=%s", appt.id)
+        return appt
+
+
+def create_appointments(appts: Iterable[Appointment]) -> None:
+    """Insert several appointments with one prepared statement, in a single transaction."""
+    rows = [
+        (appt.patient_id, appt.dentist_id, to_epoch_ms(appt.appointment_time), appt.status)
+        for appt in appts
+    ]
+    if not rows:
+        return
     with db() as conn:
-        cur = conn.execute(
+        conn.executemany(
             "INSERT INTO appointments (patient_id, dentist_id, appointment_time, status) VALUES (?, ?, ?, ?)",
-            (appt.patient_id, appt.dentist_id, appt.appointment_time.isoformat(), appt.status),
+            rows,
         )
-        appt.id = cur.lastrowid
-        logger.info("Appointment created with id=%s", appt.id)
-        return appt
+        logger.info("Created %s appointments", len(rows))
 
 
 def update_appointment_status(appt_id: int, status: str) -> bool:
@@ -89,130 +375,218 @@ def update_appointment_status(appt_id: int, status: str) -> bool:
         return cur.rowcount > 0
 
 
+# The patient's name is fetched once per call and bound in, rather than joined onto every row
+_SELECT_PATIENT_APPOINTMENTS = """
+SELECT
+    a.id as appointment_id,
+    a.appointment_time,
+    a.status,
+    d.name as dentist_name,
+    ? as patient_name
+FROM appointments a
+JOIN dentists d ON a.dentist_id = d.id
+WHERE a.patient_id = ?
+"""
+_SELECT_ALL_PATIENT_APPOINTMENTS = _SELECT_PATIENT_APPOINTMENTS + "ORDER BY a.appointment_time"
+_SELECT_SCHEDULED_PATIENT_APPOINTMENTS = _SELECT_PATIENT_APPOINTMENTS + "AND a.status = 'scheduled' ORDER BY a.appointment_time"
+
+
+def _appointment_details_dict(cursor, row) -> dict:
+    """Row factory for plain dicts with the same keys and values as AppointmentWithDetails."""
+    values = dict(zip(_APPOINTMENT_DETAILS_COLUMNS, row))
+    values["appointment_time"] = from_epoch_ms(values["appointment_time"])
+    return values
+
+
+def _patient_appointment_rows(patient_id: int, sql: str, row_factory) -> list:
+    """The appointment rows `sql` selects for the patient, built by `row_factory`."""
+    with read_conn() as conn:
+        patient = conn.execute("SELECT name FROM patients WHERE id=?", (patient_id,)).fetchone()
+        if patient is None:
+            return []
+        return _fetch(conn, row_factory, sql, (patient[0], patient_id)).fetchall()
+
+
 def get_patient_appointments(patient_id: int) -> List[AppointmentWithDetails]:
-    with db() as conn:
-        rows = conn.execute(
-            """
-            SELECT 
-                a.id as appointment_id,
-                a.appointment_time,
-                a.status,
-                d.name as dentist_name,
-                p.name as patient_name
-            FROM appointments a
-            JOIN dentists d ON a.dentist_id = d.id
-            JOIN patients p ON a.patient_id = p.id
-            WHERE a.patient_id = ?
-            ORDER BY a.appointment_time
-            """,
-            (patient_id,),
-        ).fetchall()
-        return [AppointmentWithDetails(**dict(row)) for row in rows]
+    return _patient_appointment_rows(patient_id, _SELECT_ALL_PATIENT_APPOINTMENTS, _appointment_details_from_row)
+
+
+def get_patient_scheduled_appointments(patient_id: int) -> List[dict]:
+    """
+    The patient's still scheduled appointments as plain dicts (same keys and values as
+    AppointmentWithDetails), for read-only callers that don't need models.
+    """
+    return _patient_appointment_rows(patient_id, _SELECT_SCHEDULED_PATIENT_APPOINTMENTS, _appointment_details_dict)
 
 
 # -----------------------
 # Conversation Queries
 # -----------------------
 def create_conversation(patient_id: Optional[int]) -> Conversation:
+    # One clock read for both the stored row and the returned model
+    now = now_ms()
     with db() as conn:
-        cur = conn.execute(
-            "INSERT INTO conversations (patient_id, status, started_at) VALUES (?, 'open', ?)",
-            (patient_id, datetime.now().isoformat()),
-        )
-        conv = Conversation(
-            id=cur.lastrowid,
+        conversation_id = conn.execute(
+            "INSERT INTO conversations (patient_id, status, started_at) VALUES (?, 'open', ?) RETURNING id",
+            (patient_id, now),
+        ).fetchone()[0]
+        conv = Conversation.model_construct(
+            id=conversation_id,
             patient_id=patient_id,
             status="open",
-            started_at=datetime.now(),
+            started_at=from_epoch_ms(now),
         )
-        logger.debug("Conversation created with id=%s", conv.id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Conversation created with id=%s", conv.id)
         return conv
 
 def close_conversation(conversation_id: int, reason: str):
     with db() as conn:
         conn.execute(
             "UPDATE conversations SET status='closed', ended_at=?, closed_reason=? WHERE id=?",
-            (datetime.now().isoformat(), reason, conversation_id),
+            (now_ms(), reason, conversation_id),
         )
-        logger.debug("Conversation %s closed", conversation_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Conversation %s closed", conversation_id)
 
 def add_message(conversation_id: int, sender: str, message: str) -> Message:
+    now = now_ms()
     with db() as conn:
-        cur = conn.execute(
-            "INSERT INTO messages (conversation_id, sender, message, created_at) VALUES (?, ?, ?, ?)",
-            (conversation_id, sender, message, datetime.now().isoformat()),
+        message_id = conn.execute(
+            "INSERT INTO messages (conversation_id, sender, message, created_at) VALUES (?, ?, ?, ?) RETURNING id",
+            (conversation_id, sender, message, now),
+        ).fetchone()[0]
+        conn.execute(
+            "UPDATE conversations SET last_message_id=?, last_message_at=? WHERE id=?",
+            (message_id, now, conversation_id),
         )
-        msg = Message(
-            id=cur.lastrowid,
+        msg = Message.model_construct(
+            id=message_id,
             conversation_id=conversation_id,
             sender=sender,
             message=message,
-            created_at=datetime.now(),
+            created_at=from_epoch_ms(now),
         )
-        logger.debug("Message added to conversation_id=%s", conversation_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Message added to conversation_id=%s", conversation_id)
         return msg
 
-def get_messages(conversation_id: int) -> List[Message]:
+def add_messages(items: Iterable[tuple]) -> None:
+    """
+    Insert (conversation_id, sender, message) rows with one prepared statement, in a
+    single transaction. A row may carry a fourth created_at datetime, e.g. when the
+    message was received; rows without one (or with None) are stamped with the current
+    time. Each touched conversation's last message is updated once.
+    """
+    rows = []
+    # conversation_id -> created_at of its last row, which gets the highest id
+    last_at = {}
+    now = now_ms()
+    for conversation_id, sender, message, *created_at in items:
+        at = to_epoch_ms(created_at[0]) if created_at and created_at[0] is not None else now
+        rows.append((conversation_id, sender, message, at))
+        last_at[conversation_id] = at
+    if not rows:
+        return
     with db() as conn:
+        conn.executemany(
+            "INSERT INTO messages (conversation_id, sender, message, created_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.executemany(
+            """
+            UPDATE conversations
+            SET last_message_id=(SELECT MAX(id) FROM messages WHERE conversation_id=?), last_message_at=?
+            WHERE id=?
+            """,
+            [(conversation_id, at, conversation_id) for conversation_id, at in last_at.items()],
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Added %s messages", len(rows))
+
+
+def get_messages_page(conversation_id: int, limit: int = 100, before_id: Optional[int] = None) -> MessageListResponse:
+    """
+    Up to `limit` messages of a conversation older than `before_id` (or the newest ones),
+    oldest first. Pass the first message's id as `before_id` to fetch the previous page.
+    """
+    with read_conn() as conn:
+        if before_id is None:
+            cur = _fetch(conn, _message_from_row, _SELECT_LATEST_MESSAGES, (conversation_id, limit + 1))
+        else:
+            cur = _fetch(conn, _message_from_row, _SELECT_MESSAGES_BEFORE, (conversation_id, before_id, limit + 1))
+        messages = cur.fetchall()
+    has_more = len(messages) > limit
+    del messages[limit:]
+    messages.reverse()
+    return MessageListResponse(messages=messages, has_more=has_more)
+
+
+def get_messages(conversation_id: int, limit: int = 100, before_id: Optional[int] = None) -> List[Message]:
+    """One page of get_messages_page, as a plain list."""
+    return get_messages_page(conversation_id, limit, before_id).messages
+
+
+def get_message_metadata(conversation_id: int, limit: int = 100) -> List[tuple[int, str, datetime]]:
+    """(id, sender, created_at) of a conversation's newest `limit` messages, oldest first, without their text."""
+    with read_conn() as conn:
         rows = conn.execute(
-            "SELECT * FROM messages WHERE conversation_id=? ORDER BY created_at",
-            (conversation_id,),
+            "SELECT id, sender, created_at FROM messages WHERE conversation_id=? ORDER BY id DESC LIMIT ?",
+            (conversation_id, limit),
         ).fetchall()
-        return [Message(**dict(row)) for row in rows]
+    return [(row[0], row[1], from_epoch_ms(row[2])) for row in reversed(rows)]
 
 
 def get_conversation(conversation_id: int) -> Optional[Conversation]:
-    with db() as conn:
-        row = conn.execute("SELECT * FROM conversations WHERE id=?", (conversation_id,)).fetchone()
-        return Conversation(**dict(row)) if row else None
+    with read_conn() as conn:
+        return _fetch(conn, _conversation_from_row, _SELECT_CONVERSATION_BY_ID, (conversation_id,)).fetchone()
+
+
+_SELECT_OPEN_CONVERSATION_FOR_PATIENT = _SELECT_CONVERSATIONS + """
+WHERE patient_id=? AND status='open'
+ORDER BY started_at DESC
+LIMIT 1
+"""
 
 
 def get_open_conversation(patient_id: int) -> Optional[Conversation]:
-    with db() as conn:
-        row = conn.execute(
-            """
-            SELECT * FROM conversations
-            WHERE patient_id=? AND status='open'
-            ORDER BY started_at DESC
-            LIMIT 1
-            """,
-            (patient_id,),
-        ).fetchone()
-        return Conversation(**dict(row)) if row else None
+    with read_conn() as conn:
+        return _fetch(conn, _conversation_from_row, _SELECT_OPEN_CONVERSATION_FOR_PATIENT, (patient_id,)).fetchone()
+
+
+def iter_open_conversations(batch_size: int = 500) -> Iterator[Conversation]:
+    """
+    Open conversations, built as they are fetched in batches of `batch_size`. A pooled
+    reader stays checked out until the iterator is exhausted or closed, so don't park it.
+    """
+    with read_conn() as conn:
+        cur = _fetch(conn, _conversation_from_row, _SELECT_OPEN_CONVERSATIONS)
+        while batch := cur.fetchmany(batch_size):
+            yield from batch
 
 
 def get_all_open_conversations() -> List[Conversation]:
-    with db() as conn:
-        rows = conn.execute("SELECT * FROM conversations WHERE status='open'").fetchall()
-        return [Conversation(**dict(row)) for row in rows]
+    return list(iter_open_conversations())
 
 def get_last_message_time(conversation_id: int) -> Optional[datetime]:
-    with db() as conn:
+    with read_conn() as conn:
         row = conn.execute(
-            """
-            SELECT created_at FROM messages
-            WHERE conversation_id=?
-            ORDER BY created_at DESC
-            LIMIT 1
-            """,
-            (conversation_id,),
+            "SELECT last_message_at FROM conversations WHERE id=?", (conversation_id,)
         ).fetchone()
-        return datetime.fromisoformat(row["created_at"]) if row else None
+        return from_epoch_ms(row[0]) if row and row[0] is not None else None
+
+_SELECT_LAST_MESSAGE_FOR_PATIENT = "SELECT " + ", ".join("m." + column for column in _MESSAGE_COLUMNS) + """
+FROM conversations c
+JOIN messages m ON m.id = c.last_message_id
+WHERE c.patient_id=?
+ORDER BY c.last_message_id DESC
+LIMIT 1
+"""
+
 
 def get_last_message_for_patient(patient_id: int) -> Optional[Message]:
-    with db() as conn:
-        row = conn.execute(
-            """
-            SELECT m.*
-            FROM messages m
-            JOIN conversations c ON m.conversation_id = c.id
-            WHERE c.patient_id=?
-            ORDER BY m.created_at DESC
-            LIMIT 1
-            """,
-            (patient_id,),
-        ).fetchone()
-        return Message(**dict(row)) if row else None
+    with read_conn() as conn:
+        return _fetch(conn, _message_from_row, _SELECT_LAST_MESSAGE_FOR_PATIENT, (patient_id,)).fetchone()
 
 
 # -----------------------
@@ -228,6 +602,8 @@ CREATE TABLE IF NOT EXISTS dentists (
     years_experience INTEGER,
     availability_schedule TEXT
 );
+-- Keys the idempotent seed; an index so existing databases pick it up too
+CREATE UNIQUE INDEX IF NOT EXISTS idx_dentists_name ON dentists(name);
 
 CREATE TABLE IF NOT EXISTS patients (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -236,27 +612,35 @@ CREATE TABLE IF NOT EXISTS patients (
     gender TEXT,
     phone_number TEXT NOT NULL
 );
+CREATE INDEX IF NOT EXISTS idx_patients_phone ON patients(phone_number);
 
 CREATE TABLE IF NOT EXISTS appointments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     patient_id INTEGER NOT NULL,
     dentist_id INTEGER NOT NULL,
-    appointment_time TEXT NOT NULL,
+    appointment_time INTEGER NOT NULL,
     status TEXT NOT NULL DEFAULT 'scheduled',
     FOREIGN KEY(patient_id) REFERENCES patients(id),
     FOREIGN KEY(dentist_id) REFERENCES dentists(id)
 );
+CREATE INDEX IF NOT EXISTS idx_appts_patient_status ON appointments(patient_id, status);
+CREATE INDEX IF NOT EXISTS idx_appointments_patient ON appointments(patient_id, appointment_time);
+CREATE INDEX IF NOT EXISTS idx_appointments_dentist_time ON appointments(dentist_id, appointment_time);
 
 -- Conversation sessions
 CREATE TABLE IF NOT EXISTS conversations (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     patient_id INTEGER,
     status TEXT NOT NULL DEFAULT 'open',
-    started_at TEXT NOT NULL,
-    ended_at TEXT,
+    started_at INTEGER NOT NULL,
+    ended_at INTEGER,
     closed_reason TEXT,
+    -- Denormalized newest message, kept current by add_message(s)
+    last_message_id INTEGER,
+    last_message_at INTEGER,
     FOREIGN KEY(patient_id) REFERENCES patients(id)
 );
+CREATE INDEX IF NOT EXISTS idx_conversations_patient_open ON conversations(patient_id, status, started_at DESC);
 
 -- Individual messages per conversation
 CREATE TABLE IF NOT EXISTS messages (
@@ -264,9 +648,24 @@ CREATE TABLE IF NOT EXISTS messages (
     conversation_id INTEGER NOT NULL,
     sender TEXT NOT NULL,
     message TEXT NOT NULL,
-    created_at TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
     FOREIGN KEY(conversation_id) REFERENCES conversations(id)
 );
+CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages(conversation_id, id);
+
+-- Write counters for tables whose rows are cached by readers
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO table_versions (name, version) VALUES ('dentists', 0);
+
+CREATE TRIGGER IF NOT EXISTS dentists_version_insert AFTER INSERT ON dentists
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'dentists'; END;
+CREATE TRIGGER IF NOT EXISTS dentists_version_update AFTER UPDATE ON dentists
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'dentists'; END;
+CREATE TRIGGER IF NOT EXISTS dentists_version_delete AFTER DELETE ON dentists
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'dentists'; END;
 """
 
 SEED_DENTISTS = [
@@ -278,27 +677,186 @@ SEED_DENTISTS = [
 ]
 
 
+# Timestamp columns, per table, that older databases stored as ISO-8601 TEXT
+_EPOCH_MS_COLUMNS = {
+    "appointments": ("appointment_time",),
+    "conversations": ("started_at", "ended_at", "last_message_at"),
+    "messages": ("created_at",),
+}
+
+
+def _iso_to_ms(value):
+    """Epoch ms for an ISO-8601 string, None if it doesn't parse; other values pass through."""
+    if not isinstance(value, str):
+        return value
+    try:
+        return to_epoch_ms(datetime.fromisoformat(value))
+    except ValueError:
+        return None
+
+
+# Rows whose legacy timestamps can't be converted are moved here by the migration,
+# as JSON of the original row, instead of failing startup
+_QUARANTINE_SQL = """
+CREATE TABLE IF NOT EXISTS quarantined_rows (
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    row_data TEXT NOT NULL
+);
+"""
+
+
+def _add_last_message_columns(conn: sqlite3.Connection):
+    """Adds and backfills conversations.last_message_id/_at on databases created before them."""
+    columns = {col["name"] for col in conn.execute("PRAGMA table_info(conversations)")}
+    if not columns or "last_message_id" in columns:
+        return
+
+    logger.info("Adding last message columns to conversations")
+    try:
+        conn.executescript(
+            """
+            BEGIN;
+            ALTER TABLE conversations ADD COLUMN last_message_id INTEGER;
+            ALTER TABLE conversations ADD COLUMN last_message_at INTEGER;
+            UPDATE conversations
+            SET last_message_id=(SELECT MAX(id) FROM messages WHERE conversation_id=conversations.id);
+            UPDATE conversations
+            SET last_message_at=(SELECT created_at FROM messages WHERE id=conversations.last_message_id)
+            WHERE last_message_id IS NOT NULL;
+            COMMIT;
+            """
+        )
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def _migrate_text_timestamps(conn: sqlite3.Connection):
+    """
+    Rebuilds tables whose timestamps are still ISO-8601 TEXT. SQLite can't change a
+    column's type in place, so each is renamed, recreated from SCHEMA_SQL and copied
+    back with its timestamps converted to epoch milliseconds, in one transaction.
+    Rows with a timestamp that doesn't parse (e.g. free text an earlier version stored
+    as-is) are logged and moved to quarantined_rows rather than copied.
+    """
+    stale = {}
+    for table, ms_columns in _EPOCH_MS_COLUMNS.items():
+        info = {col["name"]: col["type"] for col in conn.execute(f"PRAGMA table_info({table})")}
+        if info.get(ms_columns[0]) == "TEXT":
+            stale[table] = list(info)
+    if not stale:
+        return
+
+    logger.info("Converting timestamps to epoch milliseconds in: %s", ", ".join(stale))
+    conn.create_function("iso_to_ms", 1, _iso_to_ms, deterministic=True)
+
+    # Per table, a condition matching rows with an unconvertible timestamp, if it has any
+    unparseable = {}
+    for table, columns in stale.items():
+        ms_columns = [col for col in _EPOCH_MS_COLUMNS[table] if col in columns]
+        condition = " OR ".join(f"({col} IS NOT NULL AND iso_to_ms({col}) IS NULL)" for col in ms_columns)
+        rows = conn.execute(f"SELECT id, {', '.join(ms_columns)} FROM {table} WHERE {condition}").fetchall()
+        for row in rows:
+            for col in ms_columns:
+                if row[col] is not None and _iso_to_ms(row[col]) is None:
+                    logger.error(
+                        "Quarantining %s row id=%s: %s=%r is not an ISO-8601 timestamp",
+                        table, row["id"], col, row[col],
+                    )
+        if rows:
+            unparseable[table] = condition
+
+    # Indexes move with a renamed table and would keep SCHEMA_SQL from recreating them
+    indexes = [row[0] for row in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL AND tbl_name IN ({', '.join('?' * len(stale))})",
+        list(stale),
+    )]
+
+    # legacy_alter_table keeps the renames from rewriting other tables' foreign keys
+    script = ["PRAGMA legacy_alter_table=ON;", "BEGIN;"]
+    script += [f"ALTER TABLE {table} RENAME TO old_{table};" for table in stale]
+    script += [f"DROP INDEX {index};" for index in indexes]
+    script.append(SCHEMA_SQL)
+    if unparseable:
+        script.append(_QUARANTINE_SQL)
+    for table, columns in stale.items():
+        select = ", ".join(f"iso_to_ms({col})" if col in _EPOCH_MS_COLUMNS[table] else col for col in columns)
+        where = ""
+        if table in unparseable:
+            row_json = ", ".join(f"'{col}', {col}" for col in columns)
+            script.append(
+                f"INSERT INTO quarantined_rows (table_name, row_id, row_data) "
+                f"SELECT '{table}', id, json_object({row_json}) FROM old_{table} WHERE {unparseable[table]};"
+            )
+            where = f" WHERE NOT ({unparseable[table]})"
+        script.append(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {select} FROM old_{table}{where};")
+        script.append(f"DROP TABLE old_{table};")
+    script.append("COMMIT;")
+    try:
+        conn.executescript("\n".join(script))
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.execute("PRAGMA legacy_alter_table=OFF")
+
+
+# Stored in PRAGMA user_version once a database has the current schema and seed data.
+# Bump it with any change to SCHEMA_SQL or the migrations, so existing files pick it up.
+SCHEMA_VERSION = 1
+
+
 def init_db(seed: bool = True):
-    """Create tables if missing, seed only if dentists table is empty."""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with db() as conn:
-        conn.executescript(SCHEMA_SQL)
-        if seed:
-            existing = conn.execute("SELECT COUNT(*) FROM dentists").fetchone()[0]
-            if existing == 0:
-                conn.executemany(
-                    "INSERT INTO dentists (name, specialization, languages_spoken, qualifications, years_experience, availability_schedule) VALUES (?, ?, ?, ?, ?, ?)",
+    """
+    Create tables if missing and seed any missing dentists, in one transaction.
+    A database already at SCHEMA_VERSION is left as it is.
+    """
+    # executescript commits any open transaction first, so these can't go through db()
+    with _writer_conn() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            logger.info("Database schema is at version %s, skipping setup.", version)
+            return
+
+        # Readers and the writer no longer block each other
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Before the timestamp rebuild, which then converts last_message_at along with the rest
+        _add_last_message_columns(conn)
+        _migrate_text_timestamps(conn)
+        seeded = False
+        try:
+            conn.executescript("BEGIN IMMEDIATE;" + SCHEMA_SQL)
+            if seed:
+                cur = conn.executemany(
+                    "INSERT OR IGNORE INTO dentists (name, specialization, languages_spoken, qualifications, years_experience, availability_schedule) VALUES (?, ?, ?, ?, ?, ?)",
                     SEED_DENTISTS,
                 )
-                logger.info("Seeded 5 dentists.")
-            else:
-                logger.info("Dentists already present, skipping seeding.")
+                seeded = cur.rowcount > 0
+                if seeded:
+                    logger.info("Seeded %s dentists.", cur.rowcount)
+                else:
+                    logger.info("Dentists already present, skipping seeding.")
+                # Only a seeded database counts as fully set up
+                conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    # Once committed, so a concurrent reload can't cache the rows from before the seed
+    if seeded:
+        _reset_dentists_cache()
 
 
 def clean_db():
     if os.path.exists(DB_PATH):
         confirm = input(f"⚠️ Are you sure you want to delete {DB_PATH}? (y/N): ")
         if confirm.lower() == "y":
+            close_connection()
+            _reset_dentists_cache()
             os.remove(DB_PATH)
             logger.warning("Database deleted: %s", DB_PATH)
         else:
@@ -347,8 +905,8 @@ if __name__ == "__main__":
             logger.info(d)
 
     if args.list_patients:
-        with db() as conn:
-            rows = conn.execute("SELECT * FROM patients").fetchall()
+        with read_conn() as conn:
+            rows = conn.execute(_SELECT_PATIENTS).fetchall()
             for r in rows:
                 logger.info(dict(r))
 
@@ -1,13 +1,45 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 import os
+from typing import Optional
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _stop_log_listener():
+    """Flushes queued records and stops the listener thread."""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def install_queue_listener(root_logger: logging.Logger, *handlers: logging.Handler):
+    """
+    Routes root_logger's records through a queue to `handlers`, which a listener thread
+    writes to (honouring each handler's own level), so callers don't block on log I/O.
+    Replaces the listener of an earlier call; queued records are flushed at exit.
+    """
+    global _log_listener
+    _stop_log_listener()
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    atexit.unregister(_stop_log_listener)
+    atexit.register(_stop_log_listener)
+
 
 def setup_logging(file_level=logging.DEBUG, console_level=logging.INFO):
     """
     Configures the root logger for the application.
 
     This function sets up two handlers: one for writing to a file and one for
-    writing to stdout. Each can have a different logging level.
+    writing to stdout. Each can have a different logging level. Records are
+    queued and written by a listener thread, so callers don't block on log I/O.
 
     Args:
         file_level: The logging level for the file handler.
@@ -33,17 +65,17 @@ def setup_logging(file_level=logging.DEBUG, console_level=logging.INFO):
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
 
-    # Create and add the file handler with its own level
+    # Create the file handler with its own level
     file_handler = logging.FileHandler(log_file_path, mode='a')
     file_handler.setLevel(file_level)
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
 
-    # Create and add the stream handler (for stdout) with its own level
+    # Create the stream handler (for stdout) with its own level
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setLevel(console_level)
     stream_handler.setFormatter(formatter)
-    root_logger.addHandler(stream_handler)
+
+    install_queue_listener(root_logger, file_handler, stream_handler)
 
     logging.info("Logging configured. File level: %s, Console level: %s",
                  logging.getLevelName(file_level), logging.getLevelName(console_level))
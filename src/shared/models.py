@@ -79,3 +79,8 @@ class DentistListResponse(BaseModel):
 
 class AppointmentListResponse(BaseModel):
     appointments: List[AppointmentWithDetails]
+
+
+class MessageListResponse(BaseModel):
+    messages: List[Message]
+    has_more: bool = Field(default=False, description="True if older messages exist before this page")
@@ -0,0 +1,13 @@
+import pytest
+
+from shared import db
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Points shared.db at a fresh file and drops its connections and caches afterwards."""
+    path = tmp_path / "dentaldesk_app.db"
+    monkeypatch.setattr(db, "DB_PATH", str(path))
+    yield path
+    db.close_connection()
+    db._reset_dentists_cache()
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from shared import db
+
+
+def test_add_messages_keeps_given_created_at(db_path):
+    db.init_db()
+    conversation = db.create_conversation(None)
+    received = datetime(2020, 1, 1, 9, 0, 0, 250000)
+
+    db.add_messages([(conversation.id, "user", "hi", received), (conversation.id, "agent", "hello")])
+
+    user, agent = db.get_messages(conversation.id)
+    assert user.created_at == received
+    assert agent.created_at > received
+    assert db.get_last_message_time(conversation.id) == agent.created_at
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+from datetime import datetime
+
+from shared import db
+
+# The schema as it was before timestamps became INTEGER epoch milliseconds
+BASELINE_SCHEMA_SQL = """
+CREATE TABLE dentists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    specialization TEXT NOT NULL,
+    languages_spoken TEXT,
+    qualifications TEXT,
+    years_experience INTEGER,
+    availability_schedule TEXT
+);
+CREATE TABLE patients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    age INTEGER,
+    gender TEXT,
+    phone_number TEXT NOT NULL
+);
+CREATE TABLE appointments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id INTEGER NOT NULL,
+    dentist_id INTEGER NOT NULL,
+    appointment_time TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'scheduled',
+    FOREIGN KEY(patient_id) REFERENCES patients(id),
+    FOREIGN KEY(dentist_id) REFERENCES dentists(id)
+);
+CREATE TABLE conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'open',
+    started_at TEXT NOT NULL,
+    ended_at TEXT,
+    closed_reason TEXT,
+    FOREIGN KEY(patient_id) REFERENCES patients(id)
+);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY(conversation_id) REFERENCES conversations(id)
+);
+"""
+
+
+def _make_baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA_SQL)
+    conn.executemany(
+        "INSERT INTO dentists (name, specialization, languages_spoken, qualifications, years_experience, availability_schedule) VALUES (?, ?, ?, ?, ?, ?)",
+        db.SEED_DENTISTS,
+    )
+    conn.execute("INSERT INTO patients (name, age, gender, phone_number) VALUES ('Ann', 30, 'Female', '555')")
+    conn.executemany(
+        "INSERT INTO appointments (patient_id, dentist_id, appointment_time, status) VALUES (1, ?, ?, 'scheduled')",
+        # The second is free text a baseline reschedule_appointment stored unchecked
+        [(1, "2030-01-01T09:00:00"), (2, "2030-01-01 10:00 AM")],
+    )
+    conn.execute("INSERT INTO conversations (patient_id, status, started_at) VALUES (1, 'open', '2030-01-01T08:00:00')")
+    conn.execute("INSERT INTO messages (conversation_id, sender, message, created_at) VALUES (1, 'user', 'hi', '2030-01-01T08:00:01')")
+    conn.commit()
+    conn.close()
+
+
+def test_migration_quarantines_unparseable_timestamps(db_path, caplog):
+    _make_baseline_db(db_path)
+
+    db.init_db()
+
+    assert [(a.appointment_id, a.appointment_time) for a in db.get_patient_appointments(1)] == [
+        (1, datetime(2030, 1, 1, 9, 0)),
+    ]
+    assert [m.created_at for m in db.get_messages(1)] == [datetime(2030, 1, 1, 8, 0, 1)]
+    assert db.get_last_message_time(1) == datetime(2030, 1, 1, 8, 0, 1)
+
+    with db.read_conn() as conn:
+        quarantined = conn.execute("SELECT table_name, row_id, row_data FROM quarantined_rows").fetchall()
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert [(row[0], row[1]) for row in quarantined] == [("appointments", 2)]
+    assert json.loads(quarantined[0][2])["appointment_time"] == "2030-01-01 10:00 AM"
+    assert "appointments row id=2" in caplog.text
+
+    # Set up now, so a restart doesn't go through the migration again
+    db.init_db()
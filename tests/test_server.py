@@ -0,0 +1,34 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from dentaldesk_mcp import server
+from shared import db
+
+
+@pytest.fixture
+def utc_server(db_path, monkeypatch):
+    """A seeded database, with the server's local time zone set to UTC."""
+    monkeypatch.setenv("TZ", "UTC")
+    time.tzset()
+    db.init_db()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_offset_appointment_time_is_stored_as_local_time(utc_server):
+    booked = server.book_appointment(server.BookAppointmentPayload(
+        patient_whatsapp="555", dentist_id=1, appointment_time="2030-01-01T10:00:00+05:30", patient_name="Ann",
+    ))
+    assert booked["appointment_time"] == datetime(2030, 1, 1, 4, 30)
+
+    [appt] = server.upcoming_appointments("555")
+    assert appt["appointment_time"] == "2030-01-01T04:30:00"
+
+    # The same instant, written with an offset, finds the slot taken
+    clash = server.book_appointment(server.BookAppointmentPayload(
+        patient_whatsapp="555", dentist_id=1, appointment_time="2030-01-01T04:30:00Z",
+    ))
+    assert clash["error"] == "slot_unavailable"
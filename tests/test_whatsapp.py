@@ -0,0 +1,21 @@
+from app.whatsapp import format_message_content
+
+
+def test_bold_and_strikethrough():
+    assert format_message_content("**bold** and ~~gone~~") == "*bold* and ~gone~"
+
+
+def test_strikethrough_inside_bold():
+    assert format_message_content("**bold ~~x~~ y**") == "*bold ~x~ y*"
+
+
+def test_bold_inside_strikethrough():
+    assert format_message_content("~~a **b** c~~") == "~a *b* c~"
+
+
+def test_citation_inside_bold_is_removed():
+    assert format_message_content("**Dr. Rao【4:0†source】**") == "*Dr. Rao*"
+
+
+def test_citations_removed_and_stripped():
+    assert format_message_content("【1:2†source】 See you at 10. 【3:4†source】") == "See you at 10."